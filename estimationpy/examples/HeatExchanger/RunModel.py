@@ -3,86 +3,149 @@ Created on Nov 7, 2013
 
 @author: marco
 '''
+import os
+import sys
+import argparse
+
+import numpy
+import matplotlib
+
+# Without a display (e.g., on a server) use the non interactive backend,
+# unless a backend has been explicitly selected
+if sys.platform.startswith("linux") and not os.environ.get("DISPLAY") and not os.environ.get("MPLBACKEND"):
+    matplotlib.use("Agg")
+
 import matplotlib.pyplot as plt
-from FmuUtils import Model, Strings
+import matplotlib.dates as mdates
+from matplotlib.collections import LineCollection
+from matplotlib.lines import Line2D
+from estimationpy.fmu_utils.model import Model
+from estimationpy.fmu_utils.csv_reader import CsvReader
+from estimationpy.utils.downsample import lttb_indices
+
+import logging
+from estimationpy.fmu_utils import estimationpy_logging
 
-def main():
+# Series longer than this are downsampled before being plotted
+MAX_PLOT_POINTS = 4000
+
+def main(pdf=False):
     
     # Initialize the FMU model empty
-    m = Model.Model()
+    m = Model()
     
     # Assign an existing FMU to the model
-    filePath = "../../../modelica/FmuExamples/Resources/FMUs/HeatExchanger.fmu"
+    dir_path = os.path.dirname(__file__)
+    filePath = os.path.join(dir_path, "..", "..", "modelica", "FmuExamples", "Resources", "FMUs", "HeatExchanger.fmu")
     
     # ReInit the model with the new FMU
-    m.ReInit(filePath, atol=1e-5, rtol=1e-6)
+    m.re_init(filePath, atol=1e-5, rtol=1e-6)
     
     # Show details
     print(m)
     
     # Show the inputs
-    print("The names of the FMU inputs are: ", m.GetInputNames(), "\n")
+    print("The names of the FMU inputs are: ", m.get_input_names(), "\n")
     
     # Show the outputs
-    print("The names of the FMU outputs are:", m.GetOutputNames(), "\n")
-    
-    # Set the CSV file associated to the input
-    inputPath = "../../../modelica/FmuExamples/Resources/data/SimulationData_HeatExchanger.csv"
-    input = m.GetInputByName("mFlow_cold")
-    input.GetCsvReader().OpenCSV(inputPath)
-    input.GetCsvReader().SetSelectedColumn("heatExchanger.mFlow_COLD")
-        
-    input = m.GetInputByName("mFlow_hot")
-    input.GetCsvReader().OpenCSV(inputPath)
-    input.GetCsvReader().SetSelectedColumn("heatExchanger.mFlow_HOT")
-        
-    input = m.GetInputByName("T_hot")
-    input.GetCsvReader().OpenCSV(inputPath)
-    input.GetCsvReader().SetSelectedColumn("heatExchanger.Thot_IN")
-        
-    input = m.GetInputByName("T_cold")
-    input.GetCsvReader().OpenCSV(inputPath)
-    input.GetCsvReader().SetSelectedColumn("heatExchanger.Tcold_IN")
-    
-    m.GetState()
+    print("The names of the FMU outputs are:", m.get_output_names(), "\n")
+    
+    # Set the CSV file associated to the inputs. All the inputs share the same file,
+    # that is opened once and then each column is assigned to its input
+    inputPath = os.path.join(dir_path, "..", "..", "modelica", "FmuExamples", "Resources", "data", "SimulationData_HeatExchanger.csv")
+    reader = CsvReader()
+    reader.open_csv(inputPath)
+    
+    columns = {"mFlow_cold": "heatExchanger.mFlow_COLD",
+               "mFlow_hot": "heatExchanger.mFlow_HOT",
+               "T_hot": "heatExchanger.Thot_IN",
+               "T_cold": "heatExchanger.Tcold_IN"}
+    for name, column in columns.items():
+        reader.set_selected_column(column)
+        m.get_input_by_name(name).set_data_series(reader.get_data_series())
     
     # Initialize the model for the simulation
-    m.InitializeSimulator()
+    m.initialize_simulator()
                         
     # Simulate
-    time, results = m.Simulate()
+    time, results = m.simulate()
     
     # Show the results
-    showResults(time, results)
+    showResults(time, results, pdf)
 
-def showResults(time, results):
+def downsample(time, values, n_out):
+    
+    # Reduce the number of points of the series using the LTTB algorithm,
+    # the first and the last points are preserved
+    time_sec = numpy.asarray((time - time[0]).total_seconds())
+    idx = lttb_indices(time_sec, values, n_out)
+    return time[idx], numpy.asarray(values)[idx]
+
+def add_lines(ax, series, styles):
+    
+    # All the curves of the axes are drawn by a single LineCollection instead of
+    # one Line2D per curve. The time is converted to the numeric format used by matplotlib
+    segments = [numpy.column_stack((mdates.date2num(series[name][0]), series[name][1])) for name, _, _, _ in styles]
+    lines = LineCollection(segments, colors=[c for _, c, _, _ in styles], linestyles=[ls for _, _, ls, _ in styles])
+    lines.set_rasterized(True)
+    ax.add_collection(lines)
+    ax.xaxis_date()
+    ax.autoscale()
+    
+    # The collection does not have a label for each curve, the legend uses proxy artists
+    return [Line2D([], [], color=c, linestyle=ls, label=label) for _, c, ls, label in styles]
+
+def showResults(time, results, pdf=False):
     
     fig1 = plt.figure()
+    
+    # Long series are downsampled to twice the number of pixels available in width,
+    # points beyond the resolution of the figure would not be visible
+    names = ["Thot_IN", "Thot_OUT", "Tcold_IN", "Tcold_OUT", "Tmetal", "mFlow_COLD", "mFlow_HOT"]
+    if len(time) > MAX_PLOT_POINTS:
+        n_out = 2 * int(fig1.get_size_inches()[0] * fig1.dpi)
+        series = {name: downsample(time, results[name], n_out) for name in names}
+    else:
+        series = {name: (time, results[name]) for name in names}
+    
     ax1  = fig1.add_subplot(211)
-    ax1.plot(time,results["Thot_IN"],'r',label='$T_{Hot}^{IN}$',alpha=1.0)
-    ax1.plot(time,results["Thot_OUT"],'r--',label='$T_{Hot}^{OUT}$',alpha=1.0)
-    ax1.plot(time,results["Tcold_IN"],'b',label='$T_{Cold}^{IN}$',alpha=1.0)
-    ax1.plot(time,results["Tcold_OUT"],'b--',label='$T_{Cold}^{OUT}$',alpha=1.0)
-    ax1.plot(time,results["Tmetal"],'k',label='$T_{Metal}$',alpha=1.0)
+    handles = add_lines(ax1, series, [("Thot_IN", 'r', 'solid', '$T_{Hot}^{IN}$'),
+                                      ("Thot_OUT", 'r', 'dashed', '$T_{Hot}^{OUT}$'),
+                                      ("Tcold_IN", 'b', 'solid', '$T_{Cold}^{IN}$'),
+                                      ("Tcold_OUT", 'b', 'dashed', '$T_{Cold}^{OUT}$'),
+                                      ("Tmetal", 'k', 'solid', '$T_{Metal}$')])
     ax1.set_xlabel('Time [s]')
     ax1.set_ylabel('Water temperatures ')
     ax1.set_xlim([time[0], time[-1]])
-    legend = ax1.legend(loc='upper center',bbox_to_anchor=(0.5, 1.1), ncol=5, fancybox=True, shadow=True)
-    legend.draggable()
+    legend = ax1.legend(handles=handles, loc='upper center',bbox_to_anchor=(0.5, 1.1), ncol=5, fancybox=True, shadow=True)
+    legend.set_draggable(True)
     ax1.grid(False)
     
     ax2  = fig1.add_subplot(212)
-    ax2.plot(time,results["mFlow_COLD"],'b',label='$\dot{m}_{COLD}$',alpha=1.0)
-    ax2.plot(time,results["mFlow_HOT"],'r',label='$\dot{m}_{HOT}$',alpha=1.0)
+    handles = add_lines(ax2, series, [("mFlow_COLD", 'b', 'solid', '$\dot{m}_{COLD}$'),
+                                      ("mFlow_HOT", 'r', 'solid', '$\dot{m}_{HOT}$')])
     ax2.set_xlabel('Time [s]')
     ax2.set_ylabel('Water flows')
     ax2.set_xlim([time[0], time[-1]])
-    legend = ax2.legend(loc='upper center',bbox_to_anchor=(0.5, 1.1), ncol=2, fancybox=True, shadow=True)
-    legend.draggable()
+    legend = ax2.legend(handles=handles, loc='upper center',bbox_to_anchor=(0.5, 1.1), ncol=2, fancybox=True, shadow=True)
+    legend.set_draggable(True)
     ax2.grid(False)
     
-    plt.savefig('FirstOrder.pdf',dpi=300, bbox_inches='tight', transparent=True,pad_inches=0.1)
-    plt.show()
+    # The curves are rasterized, the PNG file is the default output while the
+    # PDF is created only when requested
+    if pdf:
+        plt.savefig('HeatExchanger.pdf',dpi=300, bbox_inches='tight', transparent=True,pad_inches=0.1)
+    else:
+        plt.savefig('HeatExchanger.png',dpi=150, bbox_inches='tight', transparent=True,pad_inches=0.1)
+    
+    if matplotlib.get_backend().lower() != "agg":
+        plt.show()
    
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Simulate the HeatExchanger FMU and plot the results")
+    parser.add_argument("--pdf", action="store_true", help="save the figure as PDF instead of PNG")
+    parser.add_argument("--debug", action="store_true", help="write DEBUG messages in the log file")
+    args = parser.parse_args()
+    log_level_file = logging.DEBUG if args.debug else logging.INFO
+    estimationpy_logging.configure_logger(log_level = log_level_file, log_level_console = logging.INFO, log_level_file = log_level_file)
+    main(pdf=args.pdf)
@@ -0,0 +1,181 @@
+"""
+This module contains the numeric kernels used by
+:class:`estimationpy.fmu_utils.in_out_var.InOutVar` to read values
+from the data series associated to inputs and outputs.
+
+The kernels operate on plain numpy arrays: the time stamps are int64
+nanoseconds and the values are float64. When **numba** is available the
+scalar kernels are compiled, otherwise they run as regular Python functions.
+The arithmetic of the vectorized kernels is evaluated by **numexpr** when
+it is installed, and by numpy otherwise.
+
+The data series may contain NaN values (e.g., missing measurements) and the
+kernels return NaN for the times out of range, for this reason the compiled
+kernels do not use the fast math flags ``nnan`` and ``ninf``.
+"""
+import numpy as np
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+from estimationpy.utils.jit import njit, prange
+
+
+@njit(cache=True, fastmath={"nsz", "arcp", "contract", "afn", "reassoc"})
+def interp_sorted(ts_ns, vals, q):
+    """
+    This function computes the linear interpolation of the values ``vals``
+    defined at the sorted time stamps ``ts_ns`` at the time ``q``.
+    A single binary search locates ``q``: if it matches one of the time stamps the
+    corresponding value is returned as is, otherwise the value is interpolated between
+    the two closest points.
+
+    :param numpy.ndarray ts_ns: sorted array of time stamps (int64 nanoseconds)
+    :param numpy.ndarray vals: array of values (float64) associated to the time stamps
+    :param int q: the time stamp (int64 nanoseconds) at which interpolating the values
+
+    :return: a tuple with the position of the first time stamp greater or equal than ``q``
+      and the value at ``q``. The value is NaN if ``q`` is out of the range covered by ``ts_ns``.
+    :rtype: tuple(int, float)
+    """
+    pos = np.searchsorted(ts_ns, q)
+    if pos < ts_ns.size and ts_ns[pos] == q:
+        return pos, vals[pos]
+    if pos <= 0 or pos >= ts_ns.size:
+        return pos, np.nan
+    t0 = ts_ns[pos - 1]
+    t1 = ts_ns[pos]
+    return pos, (vals[pos - 1] * (t1 - q) + vals[pos] * (q - t0)) / (t1 - t0)
+
+
+@njit(cache=True, fastmath={"nsz", "arcp", "contract", "afn", "reassoc"})
+def interp_uniform(ts_start, dt_ns, vals, q):
+    """
+    This function computes the linear interpolation of the values ``vals``
+    at the time ``q``, when the values are sampled with a constant period ``dt_ns``
+    starting from ``ts_start``. The position of ``q`` is computed with integer
+    arithmetic instead of a binary search.
+    The function returns the same results of :func:`interp_sorted`.
+
+    :param int ts_start: the first time stamp (int64 nanoseconds)
+    :param int dt_ns: the sampling period (int64 nanoseconds), must be positive
+    :param numpy.ndarray vals: array of values (float64) associated to the time stamps
+    :param int q: the time stamp (int64 nanoseconds) at which interpolating the values
+
+    :return: a tuple with the position of the first time stamp greater or equal than ``q``
+      and the value at ``q``. The value is NaN if ``q`` is out of the range covered by the
+      time stamps.
+    :rtype: tuple(int, float)
+    """
+    if q < ts_start:
+        return 0, np.nan
+    k = (q - ts_start) // dt_ns
+    r = (q - ts_start) - k * dt_ns
+    if r == 0:
+        if k < vals.size:
+            return k, vals[k]
+        return vals.size, np.nan
+    if k + 1 >= vals.size:
+        return vals.size, np.nan
+    return k + 1, (vals[k] * (dt_ns - r) + vals[k + 1] * r) / dt_ns
+
+
+@njit(cache=True, parallel=True)
+def interp_sorted_multi(ts_flat, vals_flat, offsets, q, fill):
+    """
+    This function computes at the time ``q`` the values of multiple data series
+    packed one after the other in the arrays ``ts_flat`` and ``vals_flat``.
+    The time stamps and the values of the i-th data series are
+    ``ts_flat[offsets[i]:offsets[i+1]]`` and ``vals_flat[offsets[i]:offsets[i+1]]``.
+    The data series are processed in parallel when numba is available.
+
+    :param numpy.ndarray ts_flat: the sorted time stamps (int64 nanoseconds) of all the data series
+    :param numpy.ndarray vals_flat: the values (float64) of all the data series
+    :param numpy.ndarray offsets: array with the position where each data series starts
+      in the two flat arrays, followed by their total length
+    :param int q: the time stamp (int64 nanoseconds) at which reading the values
+    :param float fill: the value used for the data series that do not cover the time ``q``
+
+    :return: an array with one value for each data series.
+    :rtype: numpy.ndarray
+    """
+    n = offsets.size - 1
+    out = np.empty(n)
+    for i in prange(n):
+        a = offsets[i]
+        b = offsets[i + 1]
+        if b == a or q < ts_flat[a] or q > ts_flat[b - 1]:
+            out[i] = fill
+        else:
+            out[i] = interp_sorted(ts_flat[a:b], vals_flat[a:b], q)[1]
+    return out
+
+
+def interp_sorted_many(ts_ns, vals, q_ns, dt_ns=0):
+    """
+    This function computes the linear interpolation of the values ``vals``
+    defined at the sorted time stamps ``ts_ns`` at all the times ``q_ns``.
+    The lookup of the two points that bracket each time is done with a single
+    binary search, then the interpolation formula is evaluated in a single pass.
+    With numexpr the formula does not create intermediate arrays, while the numpy
+    version updates the output array in place.
+    When the time stamps are uniformly sampled and the period ``dt_ns`` is given,
+    the positions are computed with integer arithmetic instead of the binary search.
+
+    :param numpy.ndarray ts_ns: sorted array of time stamps (int64 nanoseconds)
+    :param numpy.ndarray vals: array of values (float64) associated to the time stamps
+    :param numpy.ndarray q_ns: array of time stamps (int64 nanoseconds) at which
+      interpolating the values
+    :param int dt_ns: the sampling period of the time stamps (int64 nanoseconds),
+      0 if they are not uniformly sampled.
+
+    :return: the array of interpolated values, the elements corresponding to times out
+      of the range covered by ``ts_ns`` are NaN.
+    :rtype: numpy.ndarray
+    """
+    values = np.full(q_ns.size, np.nan)
+    N = ts_ns.size
+    if N == 0:
+        return values
+
+    # Times within the range covered by the time stamps
+    in_range = (q_ns >= ts_ns[0]) & (q_ns <= ts_ns[-1])
+    if N == 1:
+        # The only times in range match the single time stamp
+        values[in_range] = vals[0]
+        return values
+
+    # Position of the first time stamp that is greater or equal than each
+    # of the requested ones
+    t_q = q_ns[in_range]
+    if dt_ns > 0:
+        # Ceiling of the number of periods since the first time stamp
+        pos = -((ts_ns[0] - t_q) // dt_ns)
+    else:
+        pos = np.searchsorted(ts_ns, t_q)
+    exact = ts_ns[pos] == t_q
+    pos_exact = pos[exact]
+
+    # The first point is excluded so pos - 1 is always valid, a time equal to
+    # the first time stamp is an exact match and is replaced below
+    np.clip(pos, 1, N - 1, out=pos)
+    t0 = ts_ns[pos - 1]
+    t1 = ts_ns[pos]
+    v0 = vals[pos - 1]
+    v1 = vals[pos]
+
+    if numexpr is not None:
+        out = numexpr.evaluate("(v1*(t_q - t0) + v0*(t1 - t_q)) / (t1 - t0)")
+    else:
+        out = (t1 - t_q) * v0
+        out += (t_q - t0) * v1
+        out /= (t1 - t0)
+
+    # Time stamps that are part of the index return the values without interpolation,
+    # the formula may introduce a rounding error
+    out[exact] = vals[pos_exact]
+    values[in_range] = out
+
+    return values
@@ -3,12 +3,65 @@
 """
 
 import csv
+import os
 import logging
+from functools import lru_cache
 
+import numpy
 import pandas as pd
 
 logger = logging.getLogger(__name__)
 
+# Number of parsed CSV files kept in memory by :func:`_read_csv`
+CSV_CACHE_SIZE = 8
+
+
+@lru_cache(maxsize=CSV_CACHE_SIZE)
+def _read_csv(abs_path, mtime_ns, size, dialect):
+    """
+    This function parses a CSV file and returns the corresponding DataFrame, indexed
+    by the values of the first column converted to UTC datetime objects.
+    The numeric columns are stored as float64, the other columns (e.g., labels) are
+    kept as they are read so they do not prevent the numeric ones from being selected.
+    The results are cached, multiple readers that open the same file (e.g., the inputs of
+    a model that share the same CSV) parse it only once. The modification time and the size
+    of the file are part of the key, so a file modified on disk is parsed again.
+
+    The DataFrame returned is shared among the callers and must not be modified.
+
+    :param str abs_path: the absolute path of the CSV file.
+    :param int mtime_ns: modification time of the file, in nanoseconds.
+    :param int size: size of the file in bytes.
+    :param csv.Dialect dialect: the dialect used to interpret the CSV file.
+
+    :return: The DataFrame object containing the data of the CSV file.
+    :rtype: pandas.DataFrame
+
+    :raises IOError: if the file can't be read.
+    :raises pandas.errors.ParserError: if the file can't be parsed.
+    :raises ValueError: if the file can't be succesfully indexed.
+    """
+    # Load the data frame, using the first column as index
+    df = pd.read_csv(abs_path, dialect=dialect, engine="c", index_col=0)
+
+    # The numeric columns are converted to float64, the others are left unchanged
+    for c in df.columns:
+        if pd.api.types.is_numeric_dtype(df[c]) and df[c].dtype != numpy.float64:
+            df[c] = df[c].astype(numpy.float64)
+
+    # The time stamps (i.e., the index) must be unique
+    if not df.index.is_unique:
+        raise ValueError("The index of the file {0} has repeated values".format(abs_path))
+
+    # convert the index to a datetime object, assuming the values have been specified
+    # using the SI unit for time [s]
+    df.index = pd.to_datetime(numpy.asarray(df.index, dtype=numpy.float64), unit="s", utc=True)
+
+    # Sort values with respect to the index
+    df.sort_index(inplace=True)
+
+    return df
+
 
 class CsvReader:
     """
@@ -87,8 +140,10 @@ class CsvReader:
         """
         This private method is used to open a CSV file given a path name specified by the
         parameter ``csv_file``.
-        The method uses the function ``pandas.io.parsers.read_csv`` to open
-        the file.
+        The method uses the function ``pandas.read_csv`` with the C engine to open
+        the file, the time and the numeric columns are stored as float64.
+        Files that have already been parsed and did not change since then are not read
+        again, see :func:`_read_csv`.
         
         **NOTE:**
             The method assumes the first column of the CSV file is time, measured in seconds,
@@ -108,26 +163,19 @@ class CsvReader:
         # Open the file passed as parameter.
         # Read the csv file and instantiate the data frame
         try:
-            # Load the data frame
-            df = pd.io.parsers.read_csv(self.filename, dialect=self.dialect)
-
-            # Use the first column as index of the data frame
-            df.set_index(df.columns[0], inplace=True, verify_integrity=True)
-
-            # convert the index to a datetime object, assuming the values have been specified
-            # using the SI unit for time [s]
-            df.index = pd.to_datetime(df.index, unit="s", utc=True)
-
-            # Sort values with respect to the index
-            df.sort_index(inplace=True)
-
-            return df
+            stat = os.stat(self.filename)
+            return _read_csv(os.path.abspath(self.filename), stat.st_mtime_ns, stat.st_size, self.dialect)
 
         except IOError:
             msg = "The file {0} does not exist, impossible to open ".format(self.filename)
             logger.error(msg)
             return pd.DataFrame()
 
+        except pd.errors.ParserError:
+            msg = "The file {0} can't be parsed ".format(self.filename)
+            logger.error(msg)
+            return pd.DataFrame()
+
         except ValueError:
             msg = "The file {0} has problem with the time index ".format(self.filename)
             logger.error(msg)
@@ -286,8 +334,19 @@ class CsvReader:
                 # Check if the column name is part of the available dictionary
                 if self.columnSelected in self.columnNames:
 
-                    # Read the time and data column from the csv file
-                    data_series = df[self.columnSelected]
+                    # Read the time and data column from the csv file, the data frame
+                    # is shared with the other readers of the same file hence the copy
+                    data_series = df[self.columnSelected].copy()
+
+                    # The columns that are not numeric are converted only when selected
+                    if data_series.dtype != numpy.float64:
+                        try:
+                            data_series = pd.to_numeric(data_series).astype(numpy.float64)
+                        except (ValueError, TypeError):
+                            msg = "ERROR:: The column {0} of the csv file {1} is not numeric".format(
+                                self.columnSelected, self.filename)
+                            logger.error(msg)
+                            return pd.Series()
 
                     return data_series
 
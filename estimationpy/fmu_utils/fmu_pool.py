@@ -5,6 +5,7 @@ import multiprocessing
 import os
 import time
 import shutil
+import numpy
 
 from multiprocessing import Process, Queue
 from threading import Thread
@@ -60,59 +61,110 @@ class P(Process):
     def run(self):
         """
         Method that is called when the :func:`start` method of this class is invoked.
-        The method executes the following steps:
-        
-        1. Sets the values of the selected states,
-        2. Sets the values of the parameters selected,
-        3. Creates a folder that will contain the results of the simulation in case PyFMI is configured to write to the file system,
-        4. Run the simulation by calling the method :func:`estimationpy.fmu_utils.model.Model.simulate`
-        5. Saves the results in the queue using the specified index,
-        6. Removes the folder containing the result data if they were written.
-        
-        :return: False, is there are problem during the simulation, None otherwise.
+        The method runs the simulation with :func:`run_simulation` and saves the results,
+        or False if there are problem during the simulation, in the queue using the specified index.
         
         """
-        logger.debug("Start simulation in process with PID = {0}".format(os.getpid()))
-        
-        # Assign the initial conditions to the states selected
-        self.model.set_state_selected(self.x0)
-        logger.debug("Initial condition is {0}".format(self.model.get_state_observed_values()))
-            
-        # Assign the values to the parameters selected
-        self.model.set_parameters_selected(self.pars)
-        logger.debug("Parameter vector is {0}".format(self.model.get_parameter_values()))
-        
-        # Check if the options of the model contains the option for writing results to files
-        opts = self.model.get_simulation_options()
-        workWithFiles = opts[fmu_util_strings.SIMULATION_OPTION_RESHANDLING_STRING] == fmu_util_strings.RESULTS_ON_FILE_STRING
-        if workWithFiles:
-            # Create an hidden folder named as the Process ID (e.g .4354/)
-            dirPath = os.path.join(".","."+str(os.getpid()))
-            if not os.path.exists(dirPath):
-                    os.makedirs(dirPath)
-        
-            # Define the name of the file that will contain the results (e.g .4354/results.txt)
-            fileName = os.path.join(dirPath,"results.txt")
-            self.model.set_result_file(fileName)
-    
-        # Simulate
-        try:
-            results = self.model.simulate(start_time = self.startTime, final_time = self.stopTime)
-        except Exception as e:
-            logger.error("Problem while running simulation: {0}".format(str(e)))
-            results = False
+        results = run_simulation(self.model, self.x0, self.pars, self.startTime, self.stopTime)
             
         # Put the results in a queue as
         # [index, result]
         # The index will be used to sort the results in the class that manages the processes
         self.queue.put([self.index, results])
-    
-        # Delete the results contained in the folder
-        if workWithFiles:
-            shutil.rmtree(dirPath)
         
         return
 
+def run_simulation(model, x0, pars, start_time, stop_time):
+    """
+    This function runs a single simulation of a model, it is used both by the processes
+    of type :class:`P` and by the persistent workers of :class:`FmuPool`.
+    The function executes the following steps:
+    
+    1. Sets the values of the selected states,
+    2. Sets the values of the parameters selected,
+    3. Creates a folder that will contain the results of the simulation in case PyFMI is configured to write to the file system,
+    4. Run the simulation by calling the method :func:`estimationpy.fmu_utils.model.Model.simulate`
+    5. Removes the folder containing the result data if they were written.
+    
+    :param estimationpy.fmu_utils.model.Model model: The model to simulate
+    :param numpy.array x0: the vector containing the initial state of the model
+    :param np.array pars: the values of the parameters that have to be estimated
+    :param datetime.datetime start_time: the initial time of the simulation period
+    :param datetime.datetime stop_time: the end time of the simulation period
+    
+    :return: the results of the simulation, or False if there are problem during the simulation.
+    :rtype: tuple
+    """
+    logger.debug("Start simulation in process with PID = %s", os.getpid())
+    
+    # Assign the initial conditions to the states selected
+    model.set_state_selected(x0)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Initial condition is %s", model.get_state_observed_values())
+        
+    # Assign the values to the parameters selected
+    model.set_parameters_selected(pars)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Parameter vector is %s", model.get_parameter_values())
+    
+    # Check if the options of the model contains the option for writing results to files
+    opts = model.get_simulation_options()
+    workWithFiles = opts[fmu_util_strings.SIMULATION_OPTION_RESHANDLING_STRING] == fmu_util_strings.RESULTS_ON_FILE_STRING
+    if workWithFiles:
+        # Create an hidden folder named as the Process ID (e.g .4354/)
+        dirPath = os.path.join(".","."+str(os.getpid()))
+        if not os.path.exists(dirPath):
+                os.makedirs(dirPath)
+    
+        # Define the name of the file that will contain the results (e.g .4354/results.txt)
+        fileName = os.path.join(dirPath,"results.txt")
+        model.set_result_file(fileName)
+
+    # Simulate
+    try:
+        results = model.simulate(start_time = start_time, final_time = stop_time)
+    except Exception as e:
+        logger.error("Problem while running simulation: {0}".format(str(e)))
+        results = False
+
+    # Delete the results contained in the folder
+    if workWithFiles:
+        shutil.rmtree(dirPath)
+    
+    return results
+
+# Model used by the persistent workers of a FmuPool. Each worker receives its
+# own copy when it is created, see _init_worker
+_WORKER_MODEL = None
+
+def _init_worker(model):
+    """
+    Function executed once by each persistent worker of :class:`FmuPool` when it starts.
+    It stores the model, and thus the instance of the FMU, so that it is reused by
+    all the simulations executed by the worker.
+    
+    :param estimationpy.fmu_utils.model.Model model: The model to simulate
+    """
+    global _WORKER_MODEL
+    _WORKER_MODEL = model
+
+def _simulate_in_worker(args):
+    """
+    Function executed by the persistent workers of :class:`FmuPool` for each simulation.
+    Since the workers outlive a single call of :func:`FmuPool.run`, the full state of the
+    model in the main process is assigned before the selected states and parameters.
+    
+    :param tuple args: a tuple containing the index of the simulation, the full state of the model,
+      the initial values of the selected states, the parameters, the initial and final time
+      of the simulation.
+    
+    :return: a list that contains the index and the results of the simulation
+    :rtype: list
+    """
+    index, full_state, x0, pars, start_time, stop_time = args
+    _WORKER_MODEL.set_state(full_state)
+    return [index, run_simulation(_WORKER_MODEL, x0, pars, start_time, stop_time)]
+
 def threaded_function(queue, results, N_RESULTS):
     """
     This is a function executed in the main thread that reads the values in the queue, 
@@ -146,12 +198,23 @@ class FmuPool():
     
     """
     
-    def __init__(self, model, processes = multiprocessing.cpu_count()-1):
+    def __init__(self, model, processes = multiprocessing.cpu_count()-1, persistent = False):
         """
         Constructor that initializes the pool of processes that runs the simulations.
         
         :param estimationpy.fmu_utils.model.Model model: The model to simulate
         :param int processes: the number of processes allocated for the job
+        :param bool persistent: if True the simulations are executed by a set of persistent
+          workers that are created the first time the method :func:`run` is called and are reused
+          by all the following calls. Each worker keeps its own instance of the FMU, so the cost
+          of creating a new process for each simulation is paid only once per worker.
+          The workers require the *fork* start method, where it is not available a new process is
+          created for each simulation. Call :func:`close` to terminate the workers.
+          Each worker receives a copy of the model when it is created, for this reason the workers
+          are created again when the revision of the model changes, see
+          :func:`estimationpy.fmu_utils.model.Model.get_revision`. Changes made directly to the FMU
+          or to the dictionary of the simulation options are not detected, call :func:`close`
+          after making them.
           
         **NOTE**
           If the parameter ``processes`` is less or equal to 1, by default the number of 
@@ -169,6 +232,58 @@ class FmuPool():
         else:
             logger.warn("The number of processes specified in a Pool must be >=1")
             self.N_MAX_PROCESS = 1
+        
+        # Persistent workers, created when needed
+        if persistent and "fork" not in multiprocessing.get_all_start_methods():
+            logger.warning("Persistent workers require the fork start method, a process is created for each simulation")
+            persistent = False
+        self.persistent = persistent
+        self.workers = None
+        # Revision of the model copied by the workers
+        self.workers_revision = None
+    
+    def close(self):
+        """
+        This method terminates the persistent workers, if any. They are created again
+        the next time the method :func:`run` is called.
+        """
+        if self.workers is not None:
+            self.workers.close()
+            self.workers.join()
+            self.workers = None
+            self.workers_revision = None
+    
+    def __run_in_workers__(self, values, start, stop):
+        """
+        This method runs the simulations described by the list ``values`` with the
+        persistent workers, the parameters and the results are the same of :func:`__run_processes__`.
+        The workers are created again if the model changed since they were created.
+        
+        :return: a dictionary that contains the results of the simulations
+        :rtype: dict
+        """
+        revision = self.model.get_revision()
+        if self.workers is not None and revision != self.workers_revision:
+            logger.info("The model changed, the persistent workers are created again")
+            self.close()
+        
+        if self.workers is None:
+            # The model is inherited by the workers when they are forked
+            ctx = multiprocessing.get_context("fork")
+            self.workers = ctx.Pool(processes = self.N_MAX_PROCESS, initializer = _init_worker, initargs = (self.model,))
+            self.workers_revision = revision
+        
+        # The full state of the model may have changed since the workers were created
+        full_state = self.model.get_state()
+        tasks = [(j, full_state, v["state"], v["parameters"], start, stop) for j, v in enumerate(values)]
+        
+        T0 = time.time()
+        results = {}
+        for index, res in self.workers.imap_unordered(_simulate_in_worker, tasks):
+            results[index] = [res]
+        logger.debug("The time spent for running the %s simulations is %s [s]", len(values), time.time() - T0)
+        
+        return results
 
     def run(self, values, start = None, stop = None):
         """
@@ -200,6 +315,97 @@ class FmuPool():
         :rtype: dict
         
         """
+        # number of simulations to perform
+        N_SIMULATIONS = len(values)
+        
+        # Run the simulations and collect their results
+        results = self.__run_processes__(values, start, stop)
+        
+        # Create an empty list of results, and put the elements of the dictionary in order
+        try:
+            res = []
+            for k in range(N_SIMULATIONS):
+                res.insert(k, results[k])
+        except KeyError:
+            msg = "Problems while collecting the results generated by the pool of workers"
+            msg+= "\nnumber of simulations run in the e pool is {0}".format(N_SIMULATIONS)
+            msg+= "\nnumber of available results is {0}".format(len(results))
+            logger.error(msg)
+            res = {}
+        
+        # return the list of results
+        return res
+    
+    def run_batch(self, states, pars, start = None, stop = None):
+        """
+        This method performs the simulation of the model with multiple initial states and
+        parameters like :func:`run`, but the values and the results are stored in matrices
+        instead of lists of dictionaries.
+        The i-th simulation starts from the state ``states[i,:]`` and uses the parameters ``pars[i,:]``.
+        
+        :param numpy.ndarray states: a matrix with one row for each simulation containing the initial
+          values of the observed states
+        :param numpy.ndarray pars: a matrix with one row for each simulation containing the values of the
+          estimated parameters
+        :param datetime.datetime start: the initial time for the simulation, if not specified the initial time
+          of the data series associated to the inputs of the models is used
+        :param datetime.datetime stop: the final time for the simulation, if not specified the final time
+          of the data series associated to the inputs of the models is used
+        
+        :return: a tuple that contains five matrices with one row for each simulation
+        
+          * the full state at the end of the simulation,
+          * the observed states at the end of the simulation,
+          * the estimated parameters,
+          * the measured outputs at the end of the simulation,
+          * all the outputs at the end of the simulation.
+        
+          The rows associated to simulations that failed or whose results are not available are NaN.
+        
+        :rtype: tuple
+        """
+        states = numpy.atleast_2d(states)
+        pars = numpy.atleast_2d(pars)
+        n = states.shape[0]
+        
+        values = [{"state":x, "parameters":p} for x, p in zip(states, pars)]
+        results = self.__run_processes__(values, start, stop)
+        
+        # Allocate the matrices, rows not filled remain NaN
+        X = numpy.full((n, self.model.get_num_states()), numpy.nan)
+        Xo = numpy.full((n, self.model.get_num_variables()), numpy.nan)
+        p = numpy.full((n, self.model.get_num_parameters()), numpy.nan)
+        o = numpy.full((n, self.model.get_num_measured_outputs()), numpy.nan)
+        o_all = numpy.full((n, self.model.get_num_outputs()), numpy.nan)
+        
+        for k in range(n):
+            r = results.get(k)
+            if r is None or r[0] is False:
+                logger.error("The results of the simulation %s are not available", k)
+                continue
+            res = r[0][1]
+            X[k,:] = res["__ALL_STATE__"]
+            Xo[k,:] = res["__OBS_STATE__"]
+            p[k,:] = res["__PARAMS__"]
+            o[k,:] = res["__OUTPUTS__"]
+            o_all[k,:] = res["__ALL_OUTPUTS__"]
+        
+        return X, Xo, p, o, o_all
+    
+    def __run_processes__(self, values, start, stop):
+        """
+        This method runs in parallel the simulations described by the list ``values``
+        and collects their results. The parameters are the same of :func:`run`.
+        
+        :return: a dictionary that contains the results of the simulations that
+          terminated, indexed by the position of the simulation in ``values``. Each element
+          is a list containing the results returned by :func:`estimationpy.fmu_utils.model.Model.simulate`,
+          or False if the simulation failed.
+        :rtype: dict
+        """
+        if self.persistent and self.N_MAX_PROCESS > 1:
+            return self.__run_in_workers__(values, start, stop)
+        
         # Define a Queue of results
         results_queue = Queue()
         # Define a list of processes
@@ -261,14 +467,14 @@ class FmuPool():
                     
                 i += 1
 
-                msg = 'Process {0} started ({1}/{2})'.format(processes[i-1].pid, i, N_SIMULATIONS)
-                logger.debug(msg)
+                logger.debug('Process %s started (%s/%s)', processes[i-1].pid, i, N_SIMULATIONS)
             
                 # Check how many active processes have been run
                 n_active = len(multiprocessing.active_children())
 
-                logger.debug('N_process_active {0}'.format(n_active))
-                logger.debug('Queue has size {0}'.format(results_queue.qsize()))
+                logger.debug('N_process_active %s', n_active)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug('Queue has size %s', results_queue.qsize())
         
             # Wait the end of the processes to run others otherwise to exit the loop
             # N.B. 'multiprocessing.active_children()' call a .join() to every children already terminated
@@ -283,19 +489,6 @@ class FmuPool():
         # Stop Measuring the time
         Tend = time.time()
 
-        logger.debug("The time spent for running the {0} simulations is {1} [s]".format(N_SIMULATIONS, Tend - T0))
+        logger.debug("The time spent for running the %s simulations is %s [s]", N_SIMULATIONS, Tend - T0)
 
-        # Create an empty list of results, and put the elements of the dictionary in order
-        try:
-            res = []
-            for k in range(N_SIMULATIONS):
-                res.insert(k, results[k])
-        except KeyError:
-            msg = "Problems while collecting the results generated by the pool of workers"
-            msg+= "\nnumber of simulations run in the e pool is {0}".format(N_SIMULATIONS)
-            msg+= "\nnumber of available results is {0}".format(len(results))
-            logger.error(msg)
-            res = {}
-        
-        # return the list of results
-        return res
+        return results
@@ -1,10 +1,12 @@
 """
 @author: Marco Bonvini
 """
+import itertools
 import numpy
 import pandas as pd
 
 from estimationpy.fmu_utils.csv_reader import CsvReader
+from estimationpy.fmu_utils._interp import interp_sorted, interp_sorted_many, interp_uniform
 from estimationpy.fmu_utils import strings
 import pyfmi
 
@@ -12,6 +14,33 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# Source of the revision numbers of the variables, see InOutVar.get_revision
+_REVISIONS = itertools.count()
+
+# Names of the methods provided by the pyfmi FMU objects to read
+# the values of the variables of each type
+FMU_GETTERS = {
+    pyfmi.fmi.FMI_REAL: "get_real",
+    pyfmi.fmi.FMI_INTEGER: "get_integer",
+    pyfmi.fmi.FMI_BOOLEAN: "get_boolean",
+    pyfmi.fmi.FMI_ENUMERATION: "get_integer",
+    pyfmi.fmi.FMI_STRING: "get_string"
+}
+
+
+def _datetime_index_to_ns(index):
+    """
+    This function returns the time stamps of a **pandas.DatetimeIndex** as an
+    array of int64 nanoseconds since the epoch (UTC), regardless of the
+    resolution used by pandas to store them.
+
+    :param pandas.DatetimeIndex index: the index to convert.
+
+    :return: an array containing the time stamps expressed in nanoseconds.
+    :rtype: numpy.ndarray
+    """
+    return numpy.asarray(index.values, dtype="datetime64[ns]").view("i8")
+
 
 class InOutVar:
     """
@@ -38,6 +67,12 @@ class InOutVar:
     
     """
 
+    # The attributes are stored in slots rather than in a dictionary, this makes accessing them
+    # faster in the methods that are called at every step of the estimation algorithms
+    __slots__ = ("pyfmi_var", "csvReader", "index", "cov", "measOut",
+                 "_ts_ns", "_vals", "_series_name", "_series_tz", "_series_cache", "_dt_ns",
+                 "_getter_name", "_vref", "_type", "_name", "_revision")
+
     def __init__(self, pyfmi_var=None):
         """
         Consttuctor for the class :class:`InOutVar`. The constructor takes as input
@@ -52,19 +87,35 @@ class InOutVar:
         a dictionary called dataSeries = {"time": [], "data": []} that contains the two arrays that represent
         the data series (that are read from the csv file).
         
-        The integer index is used when the data values are read using the function ReadFromDataSeries, while
+        The integer index stores the position in the data series found by the last call of the
+        function ReadFromDataSeries (it is not needed to locate the next values), while
         cov is the covariance associated to the data series.
 
         :param pyfmi.fmi.ScalarVariable pyfmi_var: the pyfmi object representing a variable.
         
         """
         self.pyfmi_var = pyfmi_var
+        self.__set_getter__()
         self.csvReader = CsvReader()
-        self.dataSeries = pd.Series()
+
+        # The data series is stored as two plain arrays with the time stamps (int64 nanoseconds)
+        # and the values (float64), together with the name and the time zone of the original
+        # pandas.Series. The pandas.Series is built again only when the property dataSeries
+        # is accessed, see :func:`get_data_series`.
+        self._ts_ns = numpy.empty(0, dtype=numpy.int64)
+        self._vals = numpy.empty(0, dtype=numpy.float64)
+        self._series_name = None
+        self._series_tz = None
+        self._series_cache = None
+
+        # Sampling period (int64 nanoseconds) of the data series if it is uniformly
+        # sampled, 0 otherwise
+        self._dt_ns = 0
 
         self.index = 0
         self.cov = 1.0
         self.measOut = False
+        self._revision = next(_REVISIONS)
 
     def read_value_in_fmu(self, fmu):
         """
@@ -80,22 +131,69 @@ class InOutVar:
         :rtype: float, None
         
         """
+        if self._getter_name is None:
+            return None
+        return getattr(fmu, self._getter_name)(self._vref)[0]
+
+    def __set_getter__(self):
+        """
+        This private method identifies, given the type of the pyfmi variable associated
+        to this object, the name of the method of the FMU that reads its value.
+        The name of the method and the value reference of the variable are stored and used
+        by :func:`read_value_in_fmu`, so the type of the variable is checked only once.
+        The method also stores the type and the name of the variable. These plain values
+        are all is needed to read the variable, and unlike the pyfmi object they can
+        be pickled (see :func:`__getstate__`).
+
+        :rtype: None
+        """
+        self._getter_name = None
+        self._vref = None
+        self._type = None
+        self._name = None
+
+        if self.pyfmi_var is None:
+            return
+
         t = self.pyfmi_var.type
-        if t == pyfmi.fmi.FMI_REAL:
-            val = fmu.get_real(self.pyfmi_var.value_reference)
-        elif t == pyfmi.fmi.FMI_INTEGER:
-            val = fmu.get_integer(self.pyfmi_var.value_reference)
-        elif t == pyfmi.fmi.FMI_BOOLEAN:
-            val = fmu.get_boolean(self.pyfmi_var.value_reference)
-        elif t == pyfmi.fmi.FMI_ENUMERATION:
-            val = fmu.get_int(self.pyfmi_var.value_reference)
-        elif t == pyfmi.fmi.FMI_STRING:
-            val = fmu.get_string(self.pyfmi_var.value_reference)
-        else:
+        self._type = t
+        self._vref = self.pyfmi_var.value_reference
+        self._name = self.pyfmi_var.name
+        self._getter_name = FMU_GETTERS.get(t)
+
+        if self._getter_name is None:
             msg = "FMU-EXCEPTION, The type {0} is not known".format(t)
             logger.error(msg)
-            return None
-        return val[0]
+
+    def __getstate__(self):
+        """
+        This method returns the state of the object used by **pickle**.
+        The pyfmi variable is not included since it can't be pickled, the value
+        reference, the type, and the name of the variable are kept instead. Also the
+        pandas.Series built by :func:`get_data_series` is not included, since it can be
+        computed again from the data.
+
+        :return: a dictionary with the attributes of the object.
+        :rtype: dict
+        """
+        state = {name: getattr(self, name) for name in self.__slots__ if hasattr(self, name)}
+        state["pyfmi_var"] = None
+        state["_series_cache"] = None
+        return state
+
+    def __setstate__(self, state):
+        """
+        This method restores the state of the object unpickled, see :func:`__getstate__`.
+        After unpickling :func:`get_object` returns None, but the variable can still be
+        read from an FMU with :func:`read_value_in_fmu` and its name is available with
+        :func:`get_name`.
+
+        :param dict state: the attributes of the object.
+
+        :rtype: None
+        """
+        for name, value in state.items():
+            setattr(self, name, value)
 
     def set_measured_output(self, flag=True):
         """
@@ -105,6 +203,7 @@ class InOutVar:
           or not.
         """
         self.measOut = flag
+        self._revision = next(_REVISIONS)
 
     def is_measured_output(self):
         """
@@ -125,13 +224,14 @@ class InOutVar:
         by the state and parameter estimation algorithm.
         
         :param float cov: The value to be used as initial value in the estimation
-            algorithm. The value must be positive.
+            algorithm. The value must be positive, and it is stored as a float.
         
         :return: True if the value has been set corectly, False otherwise.
         
         :rtype: bool
         
         """
+        cov = float(cov)
         if cov > 0.0:
             self.cov = cov
             return True
@@ -163,6 +263,7 @@ class InOutVar:
         """
         if (isinstance(pyfmi_var, pyfmi.fmi.ScalarVariable)) or (isinstance(pyfmi_var, pyfmi.fmi.ScalarVariable2)):
             self.pyfmi_var = pyfmi_var
+            self.__set_getter__()
         else:
             raise TypeError(
                 "The object passed to the method InOutVar.set_object() is not of type pyfmi.fmi.ScalarVariable ")
@@ -178,6 +279,40 @@ class InOutVar:
         """
         return self.pyfmi_var
 
+    def get_name(self):
+        """
+        This method returns the name of the pyfmi variable associated to this
+        input/output variable. The name is available also when the object has been
+        unpickled and the pyfmi variable is not available anymore.
+
+        :return: the name of the variable, None if no pyfmi variable has been associated.
+        :rtype: string
+        """
+        return self._name
+
+    def get_value_reference(self):
+        """
+        This method returns the value reference of the pyfmi variable associated to this
+        input/output variable. Like the name, the value reference is available also when
+        the object has been unpickled.
+
+        :return: the value reference of the variable, None if no pyfmi variable has been associated.
+        :rtype: int
+        """
+        return self._vref
+
+    def is_real(self):
+        """
+        This method returns True if the pyfmi variable associated to this input/output
+        variable is of type real, i.e., its value is read with the method ``get_real``
+        of the FMU.
+
+        :return: True if the variable is real, False otherwise or if no pyfmi variable
+          has been associated.
+        :rtype: bool
+        """
+        return self._type == pyfmi.fmi.FMI_REAL
+
     def set_csv_reader(self, reader):
         """
         This method associates an object of type :class:`estimationpy.fmu_utils.csv_reader.CsvReader` to this
@@ -225,15 +360,15 @@ class InOutVar:
         if self.csvReader.filename == "" or self.csvReader.filename is None:
 
             # Check because the dataSeries may have bee specified using a pandas.Series
-            if len(self.dataSeries) > 0:
+            if self._ts_ns.size > 0:
                 return True
             else:
                 return False
         else:
 
             # Read the data from the CSV
-            self.dataSeries = self.csvReader.get_data_series()
-            if len(self.dataSeries) > 0:
+            self.__store_data_series__(self.csvReader.get_data_series())
+            if self._ts_ns.size > 0:
                 return True
             else:
                 return False
@@ -243,11 +378,80 @@ class InOutVar:
         This method returns the data series associated to this input/output variable.
         The dat aseries can be either specified by a CSV file by means of a
         **Csvreader** object, or directly from a **pandas.Series** object.
+
+        The data are stored internally as plain numpy arrays, the pandas.Series is built
+        from them the first time it is requested and then reused until the data series changes.
+        The values of the pandas.Series are always of type float64.
         
         :return: the pandas.Series associated to this variable.
         :rtype: pandas.Series
         """
-        return self.dataSeries
+        if self._series_cache is None:
+            index = pd.DatetimeIndex(self._ts_ns.view("datetime64[ns]"))
+            if self._series_tz is not None:
+                index = index.tz_localize("UTC").tz_convert(self._series_tz)
+            # The pandas.Series has its own copy of the values, so modifying it does not
+            # change the arrays returned by get_data_arrays
+            self._series_cache = pd.Series(self._vals.copy(), index=index, name=self._series_name)
+        return self._series_cache
+
+    def get_data_arrays(self):
+        """
+        This method returns the numpy arrays that store the data series associated to
+        this input/output variable, i.e., the time stamps as int64 nanoseconds since the
+        epoch (UTC) and the values as float64.
+        The arrays are replaced, and never modified in place, every time the data series
+        changes. For this reason the identity of the arrays can be used to detect
+        whether the data series changed.
+
+        :return: a tuple with the time stamps and the values of the data series.
+        :rtype: tuple(numpy.ndarray, numpy.ndarray)
+        """
+        return self._ts_ns, self._vals
+
+    def get_revision(self):
+        """
+        This method returns an integer that identifies the revision of this variable.
+        The revision changes every time the data series or the flag that indicates
+        a measured output are set.
+
+        :return: the revision of the variable.
+        :rtype: int
+        """
+        return self._revision
+
+    def __store_data_series__(self, series):
+        """
+        This private method copies the index and the values of a data series
+        into plain numpy arrays. The index is stored as int64 nanoseconds while the values
+        are stored as float64. These arrays are used by :func:`read_from_data_series` and
+        :func:`read_from_data_series_many` to avoid accessing the pandas.Series objects.
+        The pandas.Series is not kept, just its name and the time zone of its index.
+
+        :param pandas.Series series: the time series to be stored, indexed by a
+          **pandas.DatetimeIndex** unless it's empty.
+
+        :rtype: None
+        """
+        if len(series) > 0:
+            self._ts_ns = _datetime_index_to_ns(series.index)
+            self._series_tz = series.index.tz
+        else:
+            self._ts_ns = numpy.empty(0, dtype=numpy.int64)
+            self._series_tz = None
+        # The values are copied, so later changes to the series do not modify them
+        self._vals = numpy.array(series.values, dtype=numpy.float64)
+        self._series_name = series.name
+        self._series_cache = None
+        self._revision = next(_REVISIONS)
+
+        # Check if the data series is uniformly sampled, in that case the position of
+        # a time stamp can be computed without searching it
+        self._dt_ns = 0
+        if self._ts_ns.size > 1:
+            dt = numpy.diff(self._ts_ns)
+            if dt[0] > 0 and numpy.all(dt == dt[0]):
+                self._dt_ns = int(dt[0])
 
     def set_data_series(self, series):
         """
@@ -265,7 +469,7 @@ class InOutVar:
         """
         if isinstance(series, pd.Series):
             if isinstance(series.index, pd.DatetimeIndex):
-                self.dataSeries = series
+                self.__store_data_series__(series)
             else:
                 raise TypeError(
                     "The index of the Series passed to the method InOutVar.SetDataSeries() is not of type "
@@ -273,6 +477,10 @@ class InOutVar:
         else:
             raise TypeError("The object passed to the method InOutVar.SetDataSeries() is not of type pandas.Series ")
 
+    dataSeries = property(get_data_series, set_data_series,
+                          doc="The pandas.Series associated to this variable, "
+                              "see :func:`get_data_series` and :func:`set_data_series`.")
+
     def read_from_data_series(self, ix):
         """
         This method reads and return the value associated to the input/output variable
@@ -290,86 +498,46 @@ class InOutVar:
         :rtype: float, bool
         
         """
-        # Identify start and end date of the period covered by the time series
-        from_start = (ix - self.dataSeries.index[0]).total_seconds()
-        to_end = (self.dataSeries.index[-1] - ix).total_seconds()
+        ts_ns = self._ts_ns
+        ix_ns = pd.Timestamp(ix).value
 
-        if from_start < 0.0 or to_end < 0.0:
+        # Identify start and end date of the period covered by the time series
+        if ix_ns < ts_ns[0] or ix_ns > ts_ns[-1]:
             # The index ix is not contained in the array, it's either
             # before the start or after the end
             return False
 
-        try:
-            # try to read directly the index, if it exists it's done
-            value = self.dataSeries.loc[ix]
-            return value
-
-        except KeyError:
-
-            # The index ix is not present, an interpolation is needed.
-            # Since it is a sequential access, store the last position to reduce the access time for the next iteration
-            index = self.index
-            N = len(self.dataSeries.index)
-
-            # Start the identification of the position of the closest time step
-
-            # If len(time) = 10 and index was 2, indexes is [2, 3, 4, 5, 6, 7, 8, 9, 0, 1]
-            indexes = numpy.concatenate((numpy.arange(index, N), numpy.arange(index + 1)))
-
-            # Start the iteration
-            logger.debug("Indexes = {0}".format(indexes))
-
-            for i in range(N):
-
-                j = indexes[i]
-
-                logger.debug("j = {0}".format(j))
-
-                # Get the time values (of type Timestamp)
-                T_a = self.dataSeries.index[indexes[i]]
-                T_b = self.dataSeries.index[indexes[i + 1]]
-
-                # Since the array is circular it may be necessary to sweep the values
-                # This guarantees that T_0 is always the minimum and T_1 the maximum of 
-                # the considered interval
-                T_0 = min(T_a, T_b)
-                T_1 = max(T_a, T_b)
-
-                msg = "Time {0} and [{1}, {2}]".format(ix, T_0, T_1)
-                logger.debug(msg)
-
-                # Measure the difference in seconds between the desired index
-                # and the two points 
-                t_0 = (ix - T_0).total_seconds()
-                t_1 = (ix - T_1).total_seconds()
-
-                # Skip transition when restarting from the beginning (j == N-1)
-                # If T_0 <= ix <= T_1 the exit
-                if j != N - 1 and t_0 >= 0 >= t_1:
-                    break
-                else:
-                    # Otherwise go to the next couple of points
-                    j += 1
+        # The time stamps are sorted, a binary search identifies the position of
+        # the first time stamp that is greater or equal than ix. If ix is one of the
+        # time stamps its value is returned without interpolation, otherwise the value is
+        # interpolated between the points (pos-1, pos).
+        # The position of the last value read is kept for reference only since the
+        # binary search does not need a starting point
+        if self._dt_ns > 0:
+            # Uniformly sampled, the position is computed without searching
+            self.index, value = interp_uniform(ts_ns[0], self._dt_ns, self._vals, ix_ns)
+        else:
+            self.index, value = interp_sorted(ts_ns, self._vals, ix_ns)
+        return value
 
-            # This takes into account that the array is circular and the algorithm may
-            # finish in a zone where the order 
-            if j < N - 1:
-                index_0 = indexes[i]
-                index_1 = indexes[i + 1]
-            else:
-                index_1 = indexes[i]
-                index_0 = indexes[i - 1]
+    def read_from_data_series_many(self, ix_array):
+        """
+        This method reads and returns the values associated to the input/output variable
+        at all the times specified by the parameter ``ix_array``. The method is the
+        vectorized version of :func:`read_from_data_series` and computes all the values
+        with a single pass over the arrays that contain the time stamps and the data.
+        Time stamps that are present in the index of the pandas.Series return the
+        corresponding values, the other ones are computed with a linear interpolation
+        between the two closest values.
 
-            msg = "Picked values are {0} : {1}".format(self.dataSeries.values[index_0], self.dataSeries.values[index_1])
-            logger.debug(msg)
+        :param pandas.DatetimeIndex ix_array: the time stamps for which providing the values.
 
-            # Get distances in seconds to compute the linear interpolation
-            deltaT = (self.dataSeries.index[index_1] - self.dataSeries.index[index_0]).total_seconds()
-            dT0 = (ix - self.dataSeries.index[index_0]).total_seconds()
-            dT1 = (self.dataSeries.index[index_1] - ix).total_seconds()
-            interpData = (dT0 * self.dataSeries.values[index_1] + dT1 * self.dataSeries.values[index_0]) / deltaT
+        :return: an array with the values read from the pandas.Series associated to the
+          variable. The elements that correspond to time stamps out of the range covered by
+          the data series are equal to NaN.
 
-            # Save the index
-            self.index = j
+        :rtype: numpy.ndarray
 
-            return interpData
+        """
+        q_ns = _datetime_index_to_ns(pd.DatetimeIndex(ix_array))
+        return interp_sorted_many(self._ts_ns, self._vals, q_ns, self._dt_ns)
@@ -6,9 +6,11 @@ import pyfmi
 import numpy
 import pandas as pd
 import datetime
+import itertools
 
-from estimationpy.fmu_utils.in_out_var import InOutVar
+from estimationpy.fmu_utils.in_out_var import InOutVar, _datetime_index_to_ns
 from estimationpy.fmu_utils.estimation_variable import EstimationVariable
+from estimationpy.fmu_utils._interp import interp_sorted_multi
 
 import estimationpy.fmu_utils.strings as fmu_util_strings
 
@@ -16,6 +18,10 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# Source of the revision numbers of the models, shared by all the instances so that
+# a model that is initialized again never reuses a previous revision
+_REVISIONS = itertools.count()
+
 
 class Model:
     """
@@ -71,6 +77,14 @@ class Model:
         self.inputs = []
         # List of outputs
         self.outputs = []
+        # Value references of the real outputs and their position in the list of outputs,
+        # used to read all of them with a single call to the FMU
+        self._real_vref_arr = numpy.empty(0, dtype=numpy.uint32)
+        self._real_out_idx = numpy.empty(0, dtype=numpy.intp)
+        # Data series of the measured outputs packed by :func:`read_all_measurements`
+        self._meas_pack = None
+        # Revision of the model, see :func:`get_revision`
+        self.__bump_revision__()
 
         # Initialize the properties of the FMU
         self.name = ""
@@ -121,6 +135,7 @@ class Model:
             # the object is not yet part of the list, add it            
             par = EstimationVariable(obj, self)
             self.parameters.append(par)
+            self.__bump_revision__()
             logger.info("Added parameter: {0}".format(par.get_fmi_var().name))
             logger.debug("(... continue) Added parameter: {0} ({1})".format(obj, par))
 
@@ -150,6 +165,7 @@ class Model:
             # but before embed it into an EstimationVariable class
             var = EstimationVariable(obj, self)
             self.variables.append(var)
+            self.__bump_revision__()
             logger.info("Added variable: {0}".format(var.get_fmi_var().name))
             logger.debug("(... continue) Added variable: {0} ({1})".format(obj, var))
             return True
@@ -420,7 +436,7 @@ class Model:
 
         """
         for var in self.inputs:
-            if var.get_object().name == name:
+            if var.get_name() == name:
                 return var
         return None
 
@@ -435,7 +451,7 @@ class Model:
         inputNames = []
         for inVar in self.inputs:
             # inVar is of type InOutVar and the object that it contains is a PyFMI variable
-            inputNames.append(inVar.get_object().name)
+            inputNames.append(inVar.get_name())
         return inputNames
 
     def get_measured_output_names(self):
@@ -454,13 +470,18 @@ class Model:
         :return: A numpy array containing the values of the measured outputs.
         :rtype: numpy.array
         """
-        obsOut = numpy.zeros(self.get_num_measured_outputs())
-        i = 0
-        for o in self.outputs:
-            if o.is_measured_output():
-                obsOut[i] = o.read_value_in_fmu(self.fmu)
-                i += 1
-        return obsOut
+        return self.get_outputs_values()[self.__measured_outputs_mask__()]
+
+    def __measured_outputs_mask__(self):
+        """
+        This method returns a boolean mask that selects the measured outputs among
+        all the outputs of the model, in the same order of the list ``self.outputs``.
+
+        :return: a boolean array with the same length of the list of outputs
+        :rtype: numpy.ndarray
+        """
+        return numpy.fromiter((o.is_measured_output() for o in self.outputs), dtype=bool,
+                              count=len(self.outputs))
 
     def get_measured_data_ouputs(self, t):  # TODO: SPELLING
         """
@@ -474,13 +495,60 @@ class Model:
         :return: an array containing the values of the measured outputs at date and time t.
         :rtype: numpy.ndarray
         """
-        obsOut = numpy.zeros(shape=(1, self.get_num_measured_outputs()))
-        i = 0
-        for o in self.outputs:
-            if o.is_measured_output():
-                obsOut[0, i] = o.read_from_data_series(t)
-                i += 1
-        return obsOut
+        # The measured outputs that do not have data at time t are equal to zero
+        return self.read_all_measurements(t, fill=0.0).reshape(1, -1)
+
+    def read_all_measurements(self, ix, fill=numpy.nan):
+        """
+        This method reads the values of all the measured outputs at the time specified
+        by the parameter ``ix``, interpolating the data series when needed.
+        The data series of the measured outputs are packed together and read by a single
+        call to :func:`estimationpy.fmu_utils._interp.interp_sorted_multi`, that processes them
+        in parallel when numba is available.
+        The packed data are reused as long as the measured outputs and their data series
+        do not change.
+
+        :param datetime.datetime ix: time index at which reading the measured output data.
+        :param float fill: the value used for the outputs whose data series does not
+          cover the time ``ix``.
+
+        :return: an array containing the values of the measured outputs at time ``ix``.
+        :rtype: numpy.ndarray
+        """
+        ts_flat, vals_flat, offsets = self.__pack_measurements__()
+        return interp_sorted_multi(ts_flat, vals_flat, offsets, pd.Timestamp(ix).value, fill)
+
+    def __pack_measurements__(self):
+        """
+        This private method concatenates the time stamps and the values of the data series
+        of the measured outputs into two flat arrays, together with the offsets where each
+        data series starts. The arrays are computed again only when the data series change,
+        i.e., when :func:`estimationpy.fmu_utils.in_out_var.InOutVar.get_data_arrays` returns
+        different arrays.
+
+        :return: a tuple with the flat time stamps, the flat values and the offsets.
+        :rtype: tuple(numpy.ndarray, numpy.ndarray, numpy.ndarray)
+        """
+        sources = [o.get_data_arrays() for o in self.outputs if o.is_measured_output()]
+
+        if self._meas_pack is not None:
+            old_sources, pack = self._meas_pack
+            if len(old_sources) == len(sources) and \
+                    all(ts is old_ts and v is old_v for (ts, v), (old_ts, old_v) in zip(sources, old_sources)):
+                return pack
+
+        offsets = numpy.zeros(len(sources) + 1, dtype=numpy.int64)
+        offsets[1:] = numpy.cumsum([ts.size for ts, _ in sources])
+        if len(sources) > 0:
+            ts_flat = numpy.concatenate([ts for ts, _ in sources])
+            vals_flat = numpy.concatenate([v for _, v in sources])
+        else:
+            ts_flat = numpy.empty(0, dtype=numpy.int64)
+            vals_flat = numpy.empty(0, dtype=numpy.float64)
+
+        pack = (ts_flat, vals_flat, offsets)
+        self._meas_pack = (sources, pack)
+        return pack
 
     def get_measured_output_data_series(self):
         """
@@ -605,7 +673,7 @@ class Model:
         :rtype: estimationpy.fmu_utils.in_out_var.InOutVar, None
         """
         for var in self.outputs:
-            if var.get_object().name == name:
+            if var.get_name() == name:
                 return var
         logger.exception("Output variable with name {0} not found".format(name))
         return None
@@ -620,25 +688,46 @@ class Model:
         outputNames = []
         for outVar in self.outputs:
             # outVar is of type InOutVar and the object that it contains is a PyFMI variable
-            outputNames.append(outVar.get_object().name)
+            outputNames.append(outVar.get_name())
         return outputNames
 
     def get_outputs_values(self):
         """
         This method return a vector that contains the values of the outputs as read 
-        in the FMU associated to this model. The method uses
+        in the FMU associated to this model. The real outputs are read all together
+        with :func:`read_all_reals`, while the remaining ones (if any) are read using
         :func:`estimationpy.fmu_utils.in_out_var.InOutVar.read_value_in_fmu`.
         
         :return: an array containing the values of the outputs as read in the FMU model.
         :rtype: numpy.ndarray
         """
         obsOut = numpy.zeros(self.get_num_outputs())
-        i = 0
-        for o in self.outputs:
-            obsOut[i] = o.read_value_in_fmu(self.fmu)
-            i += 1
+        obsOut[self._real_out_idx] = self.read_all_reals(self.fmu)
+        if self._real_out_idx.size != obsOut.size:
+            is_real = numpy.zeros(obsOut.size, dtype=bool)
+            is_real[self._real_out_idx] = True
+            for i in numpy.flatnonzero(~is_real):
+                obsOut[i] = self.outputs[i].read_value_in_fmu(self.fmu)
         return obsOut
 
+    def read_all_reals(self, fmu=None):
+        """
+        This method reads the values of all the real outputs of the model with a single
+        call to ``fmu.get_real``, instead of one call per variable.
+        The values are ordered as the real outputs in the list ``self.outputs``.
+
+        :param pyfmi.FmuModel fmu: the FMU from which reading the values, if None the
+          FMU associated to this model is used.
+
+        :return: an array containing the values of the real outputs
+        :rtype: numpy.ndarray
+        """
+        if fmu is None:
+            fmu = self.fmu
+        if self._real_vref_arr.size == 0:
+            return numpy.empty(0)
+        return numpy.asarray(fmu.get_real(self._real_vref_arr), dtype=numpy.float64)
+
     def get_parameters(self):
         """
         Return the list of parameters of the model that have been selected.
@@ -741,6 +830,33 @@ class Model:
         """
         return self.fmu.get_real(var.value_reference)[0]
 
+    def get_revision(self):
+        """
+        This method returns a value that identifies the revision of the model, i.e.,
+        of everything that affects a simulation but is not passed to the simulation itself.
+        The revision changes when a real variable is set with :func:`set_real`, when the
+        simulation options or the result file change, when the simulator is initialized,
+        when the states or the parameters to estimate change, and when the data series
+        of the inputs and outputs change.
+        Setting the states and the parameters with :func:`set_state`, :func:`set_state_selected`
+        and :func:`set_parameters_selected` does not change the revision, and neither
+        changes made directly to the FMU or to the dictionary returned by
+        :func:`get_simulation_options`.
+
+        :return: a tuple that identifies the revision of the model. Two tuples are equal only
+          if nothing changed between the two calls.
+        :rtype: tuple
+        """
+        return (self._revision,) + tuple(v.get_revision() for v in self.inputs + self.outputs)
+
+    def __bump_revision__(self):
+        """
+        This private method assigns a new revision to the model, see :func:`get_revision`.
+
+        :rtype: None
+        """
+        self._revision = next(_REVISIONS)
+
     def get_simulation_options(self):
         """
         This method returns the simulation options of the simulator.
@@ -975,6 +1091,8 @@ class Model:
         :rtype: bool
         """
 
+        self.__bump_revision__()
+
         # Load the inputs and check if any problem. If any exits.
         # Align inputs while loading.
         if not self.load_input(align=True):
@@ -1188,6 +1306,7 @@ class Model:
         try:
             index = self.parameters.index(obj)
             self.parameters.pop(index)
+            self.__bump_revision__()
             return True
         except ValueError:
             # the object cannot be removed because it is not present
@@ -1201,6 +1320,7 @@ class Model:
         :rtype: None
         """
         self.parameters = []
+        self.__bump_revision__()
 
     def remove_variable(self, obj):
         """
@@ -1216,6 +1336,7 @@ class Model:
         try:
             index = self.variables.index(obj)
             self.variables.pop(index)
+            self.__bump_revision__()
             return True
         except ValueError:
             # the object cannot be removed because it is not present
@@ -1227,6 +1348,7 @@ class Model:
         This method removes all the objects from the list of parameters.
         """
         self.variables = []
+        self.__bump_revision__()
 
     def unload_fmu(self):
         """
@@ -1296,6 +1418,7 @@ class Model:
             # prepare the list of inputs and outputs
             self.__set_inputs__()
             self.__set_outputs__()
+            self.__group_real_outputs__()
 
         else:
             logger.warning("The FMU has already been assigned to this model")
@@ -1401,6 +1524,19 @@ class Model:
         """
         self.__set_in_out_var__('outputs')
 
+    def __group_real_outputs__(self):
+        """
+        This function collects the value references of the outputs of type real,
+        together with their position in the list of outputs. These arrays are used by
+        :func:`read_all_reals` to read all the real outputs with a single call to the FMU.
+
+        :rtype: None
+        """
+        reals = [i for i, o in enumerate(self.outputs) if o.is_real()]
+        self._real_out_idx = numpy.array(reals, dtype=numpy.intp)
+        self._real_vref_arr = numpy.fromiter((self.outputs[i].get_value_reference() for i in reals),
+                                             dtype=numpy.uint32, count=len(reals))
+
     def set_result_file(self, file_name):
         """
         This method modifies the name of the file that stores the simulation results.
@@ -1413,6 +1549,7 @@ class Model:
             self.opts["result_file_name"] = file_name
         else:
             self.opts["result_file_name"] = ""
+        self.__bump_revision__()
 
     def set_simulation_options(self, result_handler, solver, atol, rtol, verbose):
         """
@@ -1453,6 +1590,8 @@ class Model:
             for s in fmu_util_strings.SOLVER_NAMES_OPTIONS:
                 self.opts[s][fmu_util_strings.SOLVER_OPTION_RTOL_STRING] = rtol
 
+        self.__bump_revision__()
+
     def set_state(self, states_vector):
         """
         This method sets the value of a real variable in the FMU associated to the model.
@@ -1475,6 +1614,7 @@ class Model:
         :rtype: None
         """
         self.fmu.set_real(var.value_reference, value)
+        self.__bump_revision__()
 
     def set_state_selected(self, v):
         """
@@ -1631,13 +1771,15 @@ class Model:
 
         # Transforms to seconds with respect to the first element, again
         # if the offset is defined it needs to be used as reference
+        # The difference is computed on the int64 nanoseconds of the time stamps,
+        # and converted to seconds only at the end
         Npoints = len(time)
-        time_sec = numpy.zeros((Npoints, 1))
-        for i in range(Npoints):
-            if self.offset:
-                time_sec[i, 0] = (time[i] - self.offset).total_seconds()
-            else:
-                time_sec[i, 0] = (time[i] - time[0]).total_seconds()
+        time_ns = _datetime_index_to_ns(time)
+        if self.offset:
+            ref_ns = pd.Timestamp(self.offset).value
+        else:
+            ref_ns = time_ns[0]
+        time_sec = ((time_ns - ref_ns) / 1e9).reshape(-1, 1)
 
         # Convert to numpy matrix in case it will be stacked in a matrix
         time_sec = numpy.matrix(time_sec)
@@ -1649,10 +1791,10 @@ class Model:
             # Take all the data series
             inputMatrix = numpy.matrix(numpy.zeros((Npoints, Ninputs)))
 
+            # Each input is read over the whole simulation time grid at once
             i = 0
             for inp in self.inputs:
-                dataInput = numpy.matrix(inp.get_data_series().values).reshape(-1, 1)
-                inputMatrix[:, i] = dataInput[:, :]
+                inputMatrix[:, i] = inp.read_from_data_series_many(time).reshape(-1, 1)
                 i += 1
             # Define the input trajectory
             V = numpy.hstack((time_sec, inputMatrix))
@@ -1725,8 +1867,9 @@ class Model:
             results["__ALL_STATE__"] = self.get_state()
             results["__OBS_STATE__"] = self.get_state_observed_values()
             results["__PARAMS__"] = self.get_parameter_values()
-            results["__OUTPUTS__"] = self.get_measured_outputs_values()
-            results["__ALL_OUTPUTS__"] = self.get_outputs_values()
+            all_outputs = self.get_outputs_values()
+            results["__OUTPUTS__"] = all_outputs[self.__measured_outputs_mask__()]
+            results["__ALL_OUTPUTS__"] = all_outputs
 
         else:
             # All the results are given back
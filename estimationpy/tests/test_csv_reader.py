@@ -6,6 +6,8 @@ Created on Feb 25, 2014
 import unittest
 import numpy
 import os
+import shutil
+import tempfile
 import pandas as pd
 
 from estimationpy.fmu_utils import csv_reader
@@ -31,6 +33,7 @@ class Test(unittest.TestCase):
         self.csvNotExisting = os.path.join(dir_path, "resources", "thisFileDoesNotExist.csv")
         self.csvRepeated = os.path.join(dir_path, "resources", "simpleCsvRepeatedValues.csv")
         self.csvUnsorted = os.path.join(dir_path, "resources", "simpleCsvUnsortedValues.csv")
+        self.csvMixed = os.path.join(dir_path, "resources", "simpleCsvMixedTypes.csv")
 
         # These are the values contained into the CSV file correct
         self.colNames = ["system.u", "system.x", "system.y"]
@@ -145,6 +148,62 @@ class Test(unittest.TestCase):
         self.assertListEqual(data.index.tolist(), self.r.get_data_series().index.tolist(),
                              "The index of the pandas Series get is not equal to %s" % str(data.index))
 
+    def test_mixed_types_data_series(self):
+        # A file with a column that is not numeric can be opened
+        self.assertTrue(self.r.open_csv(self.csvMixed), "The file %s should be opened" % self.csvMixed)
+        self.assertListEqual(["system.u", "label", "system.y"], self.r.get_column_names(),
+                             "The column names of the file with mixed types are not correct")
+
+        # The numeric columns are read as float64, also if they contain integers
+        t = pd.to_datetime(numpy.linspace(0.0, 1.5, 4), unit="s", utc=True)
+        for n, v in [("system.u", 1.0), ("system.y", 1.3)]:
+            self.r.set_selected_column(n)
+            data = self.r.get_data_series()
+            self.assertEqual(numpy.float64, data.dtype, "The column %s should be float64" % n)
+            self.assertTrue(numpy.allclose(v * numpy.ones(4), data.values),
+                            "The values of the column %s are not correct" % n)
+            self.assertListEqual(t.tolist(), data.index.tolist(), "The index of the column %s is not correct" % n)
+
+        # The column that is not numeric returns an empty pandas Series
+        self.r.set_selected_column("label")
+        self.assertEqual(0, len(self.r.get_data_series()),
+                         "The column is not numeric, the method should return a pandas.Series empty")
+
+    def test_cached_csv_file(self):
+        # Copy the csv file in a temporary folder, it will be modified
+        tmp_dir = tempfile.mkdtemp()
+        tmp_csv = os.path.join(tmp_dir, "simpleCSV.csv")
+        shutil.copy(self.csvOK, tmp_csv)
+
+        try:
+            # Two readers that open the same file share the parsed data
+            r1 = csv_reader.CsvReader()
+            r1.open_csv(tmp_csv)
+            r1.set_selected_column(self.colNames[0])
+            r2 = csv_reader.CsvReader()
+            r2.open_csv(tmp_csv)
+            r2.set_selected_column(self.colNames[0])
+
+            hits = csv_reader._read_csv.cache_info().hits
+            s1 = r1.get_data_series()
+            s2 = r2.get_data_series()
+            self.assertGreaterEqual(csv_reader._read_csv.cache_info().hits, hits + 2,
+                                    "The csv file should not be parsed again")
+            self.assertTrue(numpy.allclose(s1.values, s2.values), "The two readers should return the same data")
+
+            # Modifying the data series returned does not change the data of the other reader
+            s1.iloc[0] = -1.0
+            self.assertTrue(numpy.allclose(self.u, r2.get_data_series().values),
+                            "The data series returned by the reader must be a copy")
+
+            # Once the file changes it is parsed again
+            with open(tmp_csv, "a") as f:
+                f.write("\n4.0,2.0,1.1,1.3\n")
+            self.assertEqual(9, len(r1.get_data_series()),
+                             "The csv file has been modified, the data series should contain the new value")
+        finally:
+            shutil.rmtree(tmp_dir)
+
 
 if __name__ == "__main__":
     # import sys;sys.argv = ['', 'Test.testName']
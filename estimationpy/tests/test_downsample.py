@@ -0,0 +1,58 @@
+"""
+Tests for the functions that downsample time series before plotting them.
+"""
+import unittest
+import numpy
+
+from estimationpy.utils.downsample import lttb, lttb_indices
+
+
+class Test(unittest.TestCase):
+    """
+    This class contains tests to verify the correctness
+    of the functions provided by the module
+    :mod:`estimationpy.utils.downsample`.
+    """
+
+    def setUp(self):
+        # A long and noisy series with one isolated peak
+        self.x = numpy.linspace(0.0, 100.0, 10001)
+        self.y = numpy.sin(self.x / 5.0) + 0.01 * numpy.cos(self.x * 37.0)
+        self.y[4321] = 10.0
+
+    def test_wrong_arguments(self):
+        """
+        This function checks that the arrays must have the same length and the
+        number of points must be at least 3.
+        """
+        self.assertRaises(ValueError, lttb, self.x, self.y[:-1], 100)
+        self.assertRaises(ValueError, lttb, self.x, self.y, 2)
+
+    def test_short_series(self):
+        """
+        This function checks that a series shorter than the number of points requested
+        is returned unchanged.
+        """
+        x_out, y_out = lttb(self.x[:50], self.y[:50], 100)
+        self.assertTrue(numpy.array_equal(self.x[:50], x_out), "The x values should not change")
+        self.assertTrue(numpy.array_equal(self.y[:50], y_out), "The y values should not change")
+
+    def test_lttb(self):
+        """
+        This function checks the points selected by the LTTB algorithm.
+        """
+        n_out = 500
+        idx = lttb_indices(self.x, self.y, n_out)
+        self.assertEqual(n_out, len(idx), "The downsampled series must have {0} points".format(n_out))
+        self.assertTrue(numpy.all(numpy.diff(idx) > 0), "The indexes must be sorted and unique")
+        self.assertEqual(0, idx[0], "The first point must be preserved")
+        self.assertEqual(len(self.x) - 1, idx[-1], "The last point must be preserved")
+        self.assertIn(4321, idx, "The peak of the series must be preserved")
+
+        x_out, y_out = lttb(self.x, self.y, n_out)
+        self.assertTrue(numpy.array_equal(self.x[idx], x_out), "The x values must be the ones selected")
+        self.assertTrue(numpy.array_equal(self.y[idx], y_out), "The y values must be the ones selected")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,6 +4,7 @@ Created on Jul 3, 2014
 @author: marco
 """
 import os
+import pickle
 import unittest
 import pyfmi
 import numpy
@@ -96,6 +97,30 @@ class Test(unittest.TestCase):
                               "The object returned by the GetObject method does not return a pyfmi.fmi.ScalarVariable "
                               "object")
 
+    def test_value_reference_and_type(self):
+        """
+        This function tests the methods that return the value reference and the type
+        of the PyFmiVariable object associated to the InOutVar object
+        """
+        # Without a PyFmiVariable there is no value reference and the variable is not real
+        self.assertIsNone(self.io_var.get_value_reference(), "The value reference should be None")
+        self.assertFalse(self.io_var.is_real(), "The variable should not be real")
+
+        # Real variable
+        self.io_var.set_object(pyfmi.fmi.ScalarVariable("y", 7, pyfmi.fmi.FMI_REAL))
+        self.assertEqual(7, self.io_var.get_value_reference(), "The value reference should be 7")
+        self.assertTrue(self.io_var.is_real(), "The variable should be real")
+
+        # Integer variable
+        self.io_var.set_object(pyfmi.fmi.ScalarVariable("n", 3, pyfmi.fmi.FMI_INTEGER))
+        self.assertEqual(3, self.io_var.get_value_reference(), "The value reference should be 3")
+        self.assertFalse(self.io_var.is_real(), "The variable should not be real")
+
+        # The value reference and the type are preserved by pickle
+        io_var = pickle.loads(pickle.dumps(self.io_var))
+        self.assertEqual(3, io_var.get_value_reference(), "The value reference should be 3 after pickle")
+        self.assertFalse(io_var.is_real(), "The variable should not be real after pickle")
+
     def test_set_csv_reader(self):
         """
         This function tests the method that associate a CsvReader object to the csv reader that is 
@@ -171,6 +196,38 @@ class Test(unittest.TestCase):
         self.assertListEqual(s.index.tolist(), self.io_var.get_data_series().index.tolist(),
                              "The index of the pandas Series get is not equal to %s" % str(s.index))
 
+    def test_get_data_arrays(self):
+        """
+        This function tests the method that returns the numpy arrays storing the data series.
+        The arrays are replaced every time a new data series is set.
+        """
+        s = pd.Series([1, 2, 3], index=pd.to_datetime([0, 1, 2], unit="s", utc=True))
+        self.io_var.set_data_series(s)
+
+        ts_ns, vals = self.io_var.get_data_arrays()
+        self.assertEqual(ts_ns.dtype, numpy.int64)
+        self.assertEqual(vals.dtype, numpy.float64)
+        self.assertListEqual(ts_ns.tolist(), [0, 1000000000, 2000000000])
+        self.assertListEqual(vals.tolist(), [1.0, 2.0, 3.0])
+
+        # The same arrays are returned as long as the data series does not change
+        self.assertIs(ts_ns, self.io_var.get_data_arrays()[0])
+        self.assertIs(vals, self.io_var.get_data_arrays()[1])
+
+        # Setting a new data series replaces the arrays
+        self.io_var.set_data_series(s * 2)
+        new_ts_ns, new_vals = self.io_var.get_data_arrays()
+        self.assertIsNot(vals, new_vals)
+        self.assertListEqual(new_vals.tolist(), [2.0, 4.0, 6.0])
+
+        # Modifying the pandas.Series, either the one set or the one returned, does not
+        # change the arrays
+        s2 = s * 2.0
+        self.io_var.set_data_series(s2)
+        s2.iloc[0] = 10.0
+        self.io_var.get_data_series().iloc[1] = 20.0
+        self.assertListEqual(self.io_var.get_data_arrays()[1].tolist(), [2.0, 4.0, 6.0])
+
     def test_read_from_data_series(self):
         """
         This function tests the method that allows to read a value from the data series associated to the 
@@ -216,6 +273,92 @@ class Test(unittest.TestCase):
             self.assertFalse(self.io_var.read_from_data_series(out_ix),
                              "The index is out of range and the method ReadFromDataSeries has to return False")
 
+    def test_read_from_data_series_many(self):
+        """
+        This function tests the method that allows to read multiple values at once from the data series
+        associated to the input/output variable
+        """
+        x = numpy.array([1, 2, 3, 5, 6, 7, 8, 16, 10])
+        t = numpy.array([0, 10, 20, 30, 40, 50, 60, 80, 90])
+
+        # Set a pandas.Series indexed with a pandas.DatetimeIndex
+        s = pd.Series(x, index=pd.to_datetime(t, unit="s", utc=True))
+        self.io_var.set_data_series(s)
+
+        # Read all the values at the points of the index
+        values = self.io_var.read_from_data_series_many(s.index)
+        self.assertTrue(numpy.array_equal(x, values),
+                        "The values read by the function ReadFromDataSeriesMany do not correspond to the values set")
+
+        # Read values at interpolated points, mixed with points of the index
+        new_ts = numpy.array([5.0, 22.0, 44.0, 70.0, 75.0, 5.0, 33.0, 12.0, 0.0, 90.0])
+        values = self.io_var.read_from_data_series_many(pd.to_datetime(new_ts, unit="s", utc=True))
+        self.assertTrue(numpy.array_equal(numpy.interp(new_ts, t, x), values),
+                        "The interpolated values do not match the ones computed by Numpy")
+
+        # Check that values out of the range are NaN
+        out_ts = numpy.array([-5.0, 90.1, 45.0, -0.01])
+        values = self.io_var.read_from_data_series_many(pd.to_datetime(out_ts, unit="s", utc=True))
+        self.assertTrue(numpy.array_equal(numpy.isnan(values), [True, True, False, True]),
+                        "The indexes out of range must be NaN")
+
+    def test_read_from_uniform_data_series(self):
+        """
+        This function tests the methods that read values from a data series that is uniformly sampled
+        """
+        t = numpy.linspace(0.0, 90.0, 31)
+        x = numpy.sin(t / 10.0)
+
+        s = pd.Series(x, index=pd.to_datetime(t, unit="s", utc=True))
+        self.io_var.set_data_series(s)
+
+        # Values at the points of the index and at interpolated points
+        new_ts = numpy.concatenate((t, [0.5, 22.0, 44.1, 70.0, 89.99]))
+        for new_t in new_ts:
+            int_v = self.io_var.read_from_data_series(pd.to_datetime(new_t, unit="s", utc=True))
+            self.assertAlmostEqual(numpy.interp(new_t, t, x), int_v, 12,
+                                   "The interpolated values do not match the ones computed by Numpy")
+
+        values = self.io_var.read_from_data_series_many(pd.to_datetime(new_ts, unit="s", utc=True))
+        self.assertTrue(numpy.allclose(numpy.interp(new_ts, t, x), values, rtol=0.0, atol=1e-12),
+                        "The interpolated values do not match the ones computed by Numpy")
+        self.assertTrue(numpy.array_equal(x, values[:len(t)]), "The values at the points of the index must not change")
+
+        # Check values out of the range
+        out_ts = numpy.array([-5.0, 90.1, -0.01])
+        for out_t in out_ts:
+            self.assertFalse(self.io_var.read_from_data_series(pd.to_datetime(out_t, unit="s", utc=True)),
+                             "The index is out of range and the method ReadFromDataSeries has to return False")
+        values = self.io_var.read_from_data_series_many(pd.to_datetime(out_ts, unit="s", utc=True))
+        self.assertTrue(numpy.all(numpy.isnan(values)), "The indexes out of range must be NaN")
+
+    def test_pickle(self):
+        """
+        This function tests that the object can be pickled, the pyfmi variable is
+        dropped while the information needed to read its value are preserved
+        """
+        v = pyfmi.fmi.ScalarVariable("system.y", 3, pyfmi.fmi.FMI_REAL)
+        self.io_var.set_object(v)
+        self.io_var.set_measured_output(True)
+        self.io_var.set_covariance(2.4)
+
+        s = pd.Series([1.0, 2.0, 4.0], index=pd.to_datetime([0, 10, 20], unit="s", utc=True), name="system.y")
+        self.io_var.set_data_series(s)
+
+        io_var = pickle.loads(pickle.dumps(self.io_var))
+
+        self.assertIsNone(io_var.get_object(), "The pyfmi variable should not be pickled")
+        self.assertEqual("system.y", io_var.get_name(), "The name of the variable should be preserved")
+        self.assertEqual(3, io_var.get_value_reference(), "The value reference of the variable should be preserved")
+        self.assertTrue(io_var.is_real(), "The type of the variable should be preserved")
+        self.assertTrue(io_var.is_measured_output(), "The flag measured output should be preserved")
+        self.assertEqual(2.4, io_var.get_covariance(), "The covariance should be preserved")
+        self.assertEqual(3.0, io_var.read_from_data_series(pd.to_datetime(15, unit="s", utc=True)),
+                         "The data series should be preserved")
+
+        # The original object is not modified
+        self.assertIs(v, self.io_var.get_object(), "The pyfmi variable of the original object should not change")
+
 
 if __name__ == "__main__":
     # import sys;sys.argv = ['', 'Test.testName']
@@ -48,10 +48,10 @@ class Test(unittest.TestCase):
     def tearDown(self):
         pass
 
-    def test_run_model_pool_data_series(self):
+    def set_first_order_model(self):
         """
-        This function tests if the model can be run using a pool of processes when loading data form a pandas
-        data series
+        This method creates the first order model used by the tests, with its input
+        associated to a pandas data series and the state x selected
         """
 
         # Initialize the FMU model empty
@@ -84,6 +84,17 @@ class Test(unittest.TestCase):
         # Initialize the model for the simulation
         m.initialize_simulator()
 
+        return m
+
+    def test_run_model_pool_data_series(self):
+        """
+        This function tests if the model can be run using a pool of processes when loading data form a pandas
+        data series
+        """
+
+        # Initialize the first order model
+        m = self.set_first_order_model()
+
         # Instantiate the pool
         pool = fmu_pool.FmuPool(m)
 
@@ -134,6 +145,80 @@ class Test(unittest.TestCase):
 
             i += 1
 
+    def test_run_model_pool_batch(self):
+        """
+        This function tests if the model can be run using a pool of processes when the
+        initial states and parameters are passed as matrices
+        """
+
+        # Initialize the first order model
+        m = self.set_first_order_model()
+
+        # Instantiate the pool
+        pool = fmu_pool.FmuPool(m)
+
+        # One row for each simulation, the model does not have parameters to estimate
+        n_sims = 10
+        states = np.linspace(1.0, 5.0, n_sims).reshape(n_sims, 1)
+        pars = np.zeros((n_sims, 0))
+
+        # Run simulations in parallel
+        t0 = datetime(2000, 1, 1, 0, 0, 0, tzinfo=pytz.utc)
+        t1 = datetime(2000, 1, 1, 0, 0, 30, tzinfo=pytz.utc)
+        X, Xo, p, o, o_all = pool.run_batch(states, pars, start=t0, stop=t1)
+
+        # Verify the shapes of the results
+        self.assertEqual((n_sims, 1), X.shape, "The shape of the full states is not correct")
+        self.assertEqual((n_sims, 1), Xo.shape, "The shape of the observed states is not correct")
+        self.assertEqual((n_sims, 0), p.shape, "The shape of the parameters is not correct")
+        self.assertEqual((n_sims, 1), o_all.shape, "The shape of the outputs is not correct")
+
+        # Given the input u = 1, at steady state x ~ 4 and y ~ 24
+        np.testing.assert_almost_equal(Xo[:, 0], 4.0 * np.ones(n_sims), 3,
+                                       "The steady state value of the state variable x is not 4.0")
+        np.testing.assert_almost_equal(o_all[:, 0], 24.0 * np.ones(n_sims), 2,
+                                       "The steady state value of the output variable y is not 24.0")
+
+    def test_run_model_pool_persistent(self):
+        """
+        This function tests if the persistent workers of the pool produce the same results of
+        a new process for each simulation, also after a parameter of the model changed
+        between two calls
+        """
+
+        # Initialize the first order model
+        m = self.set_first_order_model()
+
+        # Instantiate the pools, the persistent one needs at least two processes
+        pool_persistent = fmu_pool.FmuPool(m, processes=2, persistent=True)
+        pool_default = fmu_pool.FmuPool(m, processes=2)
+
+        # One row for each simulation, the model does not have parameters to estimate
+        n_sims = 10
+        states = np.linspace(1.0, 5.0, n_sims).reshape(n_sims, 1)
+        pars = np.zeros((n_sims, 0))
+
+        t0 = datetime(2000, 1, 1, 0, 0, 0, tzinfo=pytz.utc)
+        t1 = datetime(2000, 1, 1, 0, 0, 30, tzinfo=pytz.utc)
+
+        try:
+            for b, x_ss in [(4.0, 4.0), (2.0, 2.0)]:
+                # Change a parameter that is not estimated, the persistent workers must see it
+                m.set_real(m.get_variable_object("b"), b)
+
+                res_persistent = pool_persistent.run_batch(states, pars, start=t0, stop=t1)
+                res_default = pool_default.run_batch(states, pars, start=t0, stop=t1)
+
+                for r_persistent, r_default in zip(res_persistent, res_default):
+                    np.testing.assert_allclose(r_persistent, r_default, rtol=1e-10,
+                                               err_msg="The results of the persistent workers are different")
+
+                # Given the input u = 1, at steady state x ~ b
+                np.testing.assert_almost_equal(res_persistent[1][:, 0], x_ss * np.ones(n_sims), 3,
+                                               "The steady state value of the state variable x is not %s" % x_ss)
+        finally:
+            pool_persistent.close()
+
 
 if __name__ == "__main__":
     # import sys;sys.argv = ['', 'Test.testName']
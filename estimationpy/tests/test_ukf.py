@@ -6,6 +6,7 @@ Created on Feb 25, 2014
 import os
 import unittest
 import platform
+from unittest import mock
 # import pytz
 # from datetime import datetime
 import numpy as np
@@ -275,6 +276,12 @@ class Test(unittest.TestCase):
         np.testing.assert_almost_equal(s2, S2, 7,
                                        "The product of the square root matrix is not equal to the original S2")
 
+        # The result of a call is not overwritten by the following one
+        s_other = ukf_FMU.square_root(2.0 * S2)
+        self.assertIsNot(s, s_other)
+        np.testing.assert_almost_equal(np.dot(s, s.T), S2, 7,
+                                       "The square root matrix is overwritten by the following call")
+
         # Verify ability to apply constraints
         x = np.array([1.1])
         x_constr = ukf_FMU.constrained_state(x)
@@ -285,6 +292,145 @@ class Test(unittest.TestCase):
         x_expected = np.zeros(1)
         self.assertEqual(x_constr, x_expected, "This state vector does require to be constrained and it's not")
 
+        # Lists and integer arrays are accepted too
+        for x in ([-1.1], np.array([-1])):
+            x_constr = ukf_FMU.constrained_state(x)
+            np.testing.assert_equal(x_constr, x_expected, "The state vector {0} is not constrained".format(x))
+
+        return
+
+    def test_modify_constraints(self):
+        """
+        This method verifies that the constraints modified after the instantiation
+        of the UKF are used by the method that applies them.
+        """
+        # Initialize the first order model
+        self.set_first_order_model()
+
+        # Associate inputs and outputs
+        self.set_first_order_model_input_outputs()
+
+        # Define the variables to estimate
+        self.set_state_to_estimate_first_order()
+
+        ukf_FMU = UkfFmu(self.m)
+
+        # Activate the upper bound of the state
+        ukf_FMU.constrStateValueHigh = [1.0]
+        ukf_FMU.constrStateHigh = [True]
+        x_constr = ukf_FMU.constrained_state(np.array([1.1]))
+        np.testing.assert_equal(x_constr, np.ones(1), "The new upper bound of the state is not applied")
+
+        # Deactivate the lower bound of the state
+        ukf_FMU.constrStateLow = [False]
+        x_constr = ukf_FMU.constrained_state(np.array([-1.1]))
+        np.testing.assert_equal(x_constr, -1.1*np.ones(1), "The lower bound of the state is still applied")
+
+        # The arrays cannot be modified in place, and must have one element per state
+        with self.assertRaises(ValueError):
+            ukf_FMU.constrStateLow[0] = True
+        with self.assertRaises(ValueError):
+            ukf_FMU.constrStateValueLow = [0.0, 0.0]
+
+        # Integer matrices are converted before being constrained
+        X = ukf_FMU._constrained_state_batch(np.array([[2], [-2]]))
+        np.testing.assert_equal(X, np.array([[1.0], [-2.0]]), "The integer matrix is not constrained")
+
+        return
+
+    def test_compute_P_without_numba(self):
+        """
+        This method tests the computation of the covariance matrix when numba is not
+        available, i.e., the weighted sum of the outer products computed with BLAS.
+        The weight of the central sigma point can be negative.
+        """
+        # Initialize the first order model
+        self.set_first_order_model()
+
+        # Associate inputs and outputs
+        self.set_first_order_model_input_outputs()
+
+        # Define the variables to estimate
+        self.set_state_to_estimate_first_order()
+
+        # Retry to instantiate, now with a proper model
+        ukf_FMU = UkfFmu(self.m)
+
+        # The number of rows of the sigma points is fixed by the number of weights,
+        # the number of columns is arbitrary
+        n_points = ukf_FMU.W_c.shape[0]
+        n = 4
+        X = np.random.uniform(-2.0, 2.0, (n_points, n))
+        Q = 0.5 * np.eye(n)
+
+        # Default parameters, and parameters with a negative weight for the central point
+        for alpha, k in [(1.0 / np.sqrt(3.0), None), (0.5, 0)]:
+            ukf_FMU.set_ukf_params(alpha=alpha, k=k)
+            W_c = ukf_FMU.W_c[:, 0]
+            X_avg = ukf_FMU.average_proj(X)
+
+            # Explicit weighted sum of the outer products
+            P = Q.copy()
+            for w, x in zip(W_c, X):
+                error = (x - X_avg).reshape(n, 1)
+                P += w * np.dot(error, error.T)
+
+            with mock.patch("estimationpy.ukf.ukf_fmu.HAS_NUMBA", False):
+                P_syrk = ukf_FMU.compute_P(X, X_avg, Q)
+
+            np.testing.assert_almost_equal(P_syrk, P, 10,
+                                           "The covariance matrix computed without numba is not correct")
+
+        self.assertTrue(W_c[0] < 0.0, "The weight of the central sigma point should be negative")
+
+        return
+
+    def test_compute_cov_x_y_output_coupling(self):
+        """
+        This method tests the cross covariance between states and outputs when only
+        some of the estimated states and parameters are coupled to the measured outputs.
+        The rows of the coupled variables must be equal to the ones of the full matrix,
+        while the other rows must be zero. The test is repeated with and without numba.
+        """
+        # The valve example estimates one state and one parameter
+        self.set_valve_model()
+        self.set_valve_model_input_outputs()
+        self.set_state_and_param_to_estimate_valve()
+
+        ukf_FMU = UkfFmu(self.m)
+
+        n_points = ukf_FMU.W_c.shape[0]
+        N = ukf_FMU.N
+        m = 3
+        X = np.random.uniform(-2.0, 2.0, (n_points, N))
+        Y = np.random.uniform(-2.0, 2.0, (n_points, m))
+        X_avg = ukf_FMU.average_proj(X)
+        Y_avg = ukf_FMU.average_proj(Y)
+
+        for has_numba in [True, False]:
+            with mock.patch("estimationpy.ukf.ukf_fmu.HAS_NUMBA", has_numba):
+                ukf_FMU.set_output_coupling(None)
+                C_full = ukf_FMU.compute_cov_x_y(X, X_avg, Y, Y_avg)
+                self.assertEqual((N, m), C_full.shape)
+
+                # The same coupling defined by indices and by a boolean mask
+                for cols in [[1], np.array([False, True])]:
+                    ukf_FMU.set_output_coupling(cols)
+                    C = ukf_FMU.compute_cov_x_y(X, X_avg, Y, Y_avg)
+
+                    self.assertEqual((N, m), C.shape)
+                    np.testing.assert_almost_equal(C[1, :], C_full[1, :], 12,
+                                                   "The rows of the coupled variables are not correct")
+                    np.testing.assert_equal(C[0, :], np.zeros(m),
+                                            "The rows of the variables not coupled must be zero")
+
+        ukf_FMU.set_output_coupling(None)
+
+        # The mask must have one element per state and parameter, the indices must be valid
+        self.assertRaises(ValueError, ukf_FMU.set_output_coupling, [True, False, True])
+        self.assertRaises(ValueError, ukf_FMU.set_output_coupling, [N])
+        self.assertRaises(ValueError, ukf_FMU.set_output_coupling, [-1])
+
         return
 
     def test_chol_update(self):
@@ -352,6 +498,56 @@ class Test(unittest.TestCase):
 
         return
 
+    def test_chol_downdate(self):
+        """
+        This method tests the rank-k Cholesky downdate used to correct the
+        square root covariance matrix, comparing it with the column by column
+        downdate computed by the Cholesky update method.
+        """
+        # Initialize the first order model
+        self.set_first_order_model()
+
+        # Associate inputs and outputs
+        self.set_first_order_model_input_outputs()
+
+        # Define the variables to estimate
+        self.set_state_to_estimate_first_order()
+
+        ukf_FMU = UkfFmu(self.m)
+
+        # Well conditioned upper triangular square root matrix and downdate vectors
+        n = 6
+        k = 2
+        A = np.random.uniform(-1.0, 1.0, (n, n))
+        S = np.linalg.cholesky(np.dot(A, A.T) + n * np.eye(n)).T
+        U = np.random.uniform(-0.1, 0.1, (n, k))
+
+        S_new = ukf_FMU.chol_downdate(S, U)
+        S_ref = ukf_FMU.chol_update(S, U, -np.ones(k))
+
+        np.testing.assert_almost_equal(S_new, S_ref, 10,
+                                       "The rank-k downdate is not equal to the column by column downdate")
+        np.testing.assert_almost_equal(np.dot(S_new.T, S_new), np.dot(S.T, S) - np.dot(U, U.T), 10,
+                                       "The rank-k downdate is not correct")
+
+        # In single precision the result is computed in double precision and then converted
+        ukf_FMU.set_dtype(np.float32, use_double_for_chol_update=False)
+        S_32 = ukf_FMU.chol_downdate(S.astype(np.float32), U.astype(np.float32))
+        self.assertEqual(S_32.dtype, np.float32)
+        np.testing.assert_allclose(S_32, S_new, rtol=1e-4, atol=1e-5,
+                                   err_msg="The rank-k downdate in single precision is not correct")
+        ukf_FMU.set_dtype(np.float64)
+
+        # When the downdate vectors are too large the matrix is not positive definite
+        # and the column by column downdate is used
+        U_large = 10.0 * np.linalg.norm(S) * np.ones((n, k))
+        with mock.patch.object(ukf_FMU, "chol_update", wraps=ukf_FMU.chol_update) as chol_update:
+            S_fallback = ukf_FMU.chol_downdate(S, U_large)
+        self.assertEqual(chol_update.call_count, 1, "The column by column downdate is not used")
+        np.testing.assert_equal(S_fallback, ukf_FMU.chol_update(S, U_large, -np.ones(k)))
+
+        return
+
     def test_create_sigma_points(self):
         """
         This method tests the Cholesky update method that is used to compute
@@ -433,6 +629,43 @@ class Test(unittest.TestCase):
 
         return
 
+    def test_find_closest_matches(self):
+        """
+        This method tests the function that selects the time steps to filter. The start
+        and stop times must be datetime objects comparable with the time index.
+        """
+        time = pd.date_range("2000-01-01", periods=31, freq="s", tz="UTC")
+
+        # Time stamps that are part of the index, or between two of its elements
+        t0 = pd.Timestamp("2000-01-01 00:00:05", tz="UTC")
+        t1 = pd.Timestamp("2000-01-01 00:00:20.5", tz="UTC")
+        self.assertEqual((5, 21), UkfFmu.find_closest_matches(t0, t1, time))
+
+        # The same instants expressed in an other time zone
+        self.assertEqual((5, 21), UkfFmu.find_closest_matches(t0.tz_convert("US/Pacific"),
+                                                              t1.tz_convert("US/Pacific"), time))
+
+        # Out of range and inverted start and stop
+        t_out = pd.Timestamp("2000-01-01 00:01:00", tz="UTC")
+        self.assertRaises(IndexError, UkfFmu.find_closest_matches, t_out, t1, time)
+        self.assertRaises(IndexError, UkfFmu.find_closest_matches, t0, t_out, time)
+        self.assertRaises(ValueError, UkfFmu.find_closest_matches, t1, t0, time)
+
+        # Numbers are not interpreted as time stamps
+        self.assertRaises(TypeError, UkfFmu.find_closest_matches, 0.0, 5.0, time)
+        self.assertRaises(TypeError, UkfFmu.find_closest_matches, t0, 20, time)
+
+        # Timezone naive datetime objects are not assumed to be UTC
+        self.assertRaises(TypeError, UkfFmu.find_closest_matches, t0.tz_localize(None), t1, time)
+        self.assertRaises(TypeError, UkfFmu.find_closest_matches, t0, t1.tz_localize(None).to_pydatetime(), time)
+
+        # Timezone naive datetime objects can be used with a timezone naive index
+        self.assertEqual((5, 21), UkfFmu.find_closest_matches(t0.tz_localize(None), t1.tz_localize(None),
+                                                              time.tz_localize(None)))
+        self.assertRaises(TypeError, UkfFmu.find_closest_matches, t0, t1, time.tz_localize(None))
+
+        return
+
     def test_ukf_filter_first_order(self):
         """
         This method tests the ability of the filter to estimate the state
@@ -503,6 +736,175 @@ class Test(unittest.TestCase):
 
         return
 
+    def test_ukf_filter_single_precision(self):
+        """
+        This method tests the filter of the first order system when the square root
+        covariance matrices are in single precision. The estimations must be close to
+        the ones computed in double precision.
+        """
+        results = {}
+        for dtype in [np.float64, np.float32]:
+            # Initialize the first order model, every run starts from the same state
+            self.set_first_order_model()
+            self.set_first_order_model_input_outputs()
+            self.set_state_to_estimate_first_order()
+            self.m.initialize_simulator()
+
+            ukf_FMU = UkfFmu(self.m)
+            ukf_FMU.set_dtype(dtype)
+
+            # Start the filter
+            t0 = pd.to_datetime(0.0, unit="s", utc=True)
+            t1 = pd.to_datetime(30.0, unit="s", utc=True)
+            results[dtype] = ukf_FMU.filter(start=t0, stop=t1)
+
+        # Only the square root covariance matrices use the type selected
+        time, x, sqrtP, y, Sy, y_full = results[np.float32]
+        self.assertEqual(np.float64, x.dtype, "The estimated states must be double precision")
+        self.assertEqual(np.float32, sqrtP.dtype, "The covariance of the states must be single precision")
+        self.assertEqual(np.float64, y.dtype, "The estimated outputs must be double precision")
+        self.assertEqual(np.float32, Sy.dtype, "The covariance of the outputs must be single precision")
+        self.assertEqual(np.float64, y_full.dtype, "The full outputs must be double precision")
+
+        # Compare with the double precision estimations
+        time_64, x_64, sqrtP_64, y_64, Sy_64, y_full_64 = results[np.float64]
+        np.testing.assert_allclose(x, x_64, rtol=0.0, atol=1e-4,
+                                   err_msg="The states estimated in single precision are not correct")
+        np.testing.assert_allclose(sqrtP, sqrtP_64, rtol=0.0, atol=1e-4,
+                                   err_msg="The covariance estimated in single precision is not correct")
+        np.testing.assert_allclose(y, y_64, rtol=0.0, atol=1e-3,
+                                   err_msg="The outputs estimated in single precision are not correct")
+
+        # Only single and double precision are supported
+        self.assertRaises(ValueError, ukf_FMU.set_dtype, np.int32)
+
+        return
+
+    def test_ukf_filter_mixed_precision(self):
+        """
+        This method tests the filter of the first order system when the mixed precision
+        mode is enabled, i.e., the sigma points and their projections are single precision.
+        The mode is tested alone and together with the single precision square root
+        covariance matrices. The estimations must be close to the ones computed in
+        double precision.
+        """
+        configurations = [(np.float64, False), (np.float64, True), (np.float32, True)]
+        results = {}
+        for dtype, mixed in configurations:
+            # Initialize the first order model, every run starts from the same state
+            self.set_first_order_model()
+            self.set_first_order_model_input_outputs()
+            self.set_state_to_estimate_first_order()
+            self.m.initialize_simulator()
+
+            ukf_FMU = UkfFmu(self.m)
+            ukf_FMU.set_dtype(dtype)
+            ukf_FMU.set_mixed_precision(mixed)
+
+            # The buffers of the sigma points and of their projections are single precision
+            if mixed:
+                self.assertEqual(np.float32, ukf_FMU._Xs.dtype, "The sigma points must be single precision")
+                self.assertEqual(np.float32, ukf_FMU._X_proj.dtype, "The projections must be single precision")
+                self.assertEqual(np.float32, ukf_FMU._Z_proj.dtype, "The outputs must be single precision")
+
+            # Start the filter
+            t0 = pd.to_datetime(0.0, unit="s", utc=True)
+            t1 = pd.to_datetime(30.0, unit="s", utc=True)
+            results[(dtype, mixed)] = ukf_FMU.filter(start=t0, stop=t1)
+
+        time_64, x_64, sqrtP_64, y_64, Sy_64, y_full_64 = results[(np.float64, False)]
+        for dtype, mixed in configurations[1:]:
+            time, x, sqrtP, y, Sy, y_full = results[(dtype, mixed)]
+
+            # The estimations are double precision, the square root covariance matrices
+            # have the type selected with set_dtype
+            self.assertEqual(np.float64, x.dtype, "The estimated states must be double precision")
+            self.assertEqual(np.float64, y.dtype, "The estimated outputs must be double precision")
+            self.assertEqual(dtype, sqrtP.dtype, "The covariance of the states has the wrong type")
+
+            # Compare with the double precision estimations
+            np.testing.assert_allclose(x, x_64, rtol=0.0, atol=1e-4,
+                                       err_msg="The states estimated in mixed precision are not correct")
+            np.testing.assert_allclose(sqrtP, sqrtP_64, rtol=0.0, atol=1e-4,
+                                       err_msg="The covariance estimated in mixed precision is not correct")
+            np.testing.assert_allclose(y, y_64, rtol=0.0, atol=1e-3,
+                                       err_msg="The outputs estimated in mixed precision are not correct")
+
+        return
+
+    def test_ukf_filter_missing_measurements(self):
+        """
+        This method tests the filter when some of the measured outputs are missing, i.e.,
+        they are equal to NaN. During the gap the filter only predicts the state, so the
+        estimation is finite and its covariance grows, while the other steps are the
+        same of the method :func:`estimationpy.ukf.ukf_fmu.UkfFmu.ukf_step`.
+        """
+        # Initialize the first order model
+        self.set_first_order_model()
+
+        # Associate inputs and outputs
+        self.set_first_order_model_input_outputs()
+
+        # Define the variables to estimate
+        self.set_state_to_estimate_first_order()
+
+        # Initialize the simulator
+        self.m.initialize_simulator()
+
+        # Filtering period
+        t0 = pd.to_datetime(0.0, unit="s", utc=True)
+        t1 = pd.to_datetime(30.0, unit="s", utc=True)
+
+        # Remove the measurements taken from 10 s (included) to 15 s (excluded)
+        output = self.m.get_output_by_name("y")
+        data = output.get_data_series().copy()
+        in_gap = (data.index >= t0 + pd.Timedelta(seconds=10)) & (data.index < t0 + pd.Timedelta(seconds=15))
+        data[in_gap] = np.nan
+        output.set_data_series(data)
+
+        # Retry to instantiate, now with a proper model
+        ukf_FMU = UkfFmu(self.m)
+
+        # Start the filter
+        time, x, sqrtP, y, Sy, y_full, x_full, sqrt_Q, sqrt_R = ukf_FMU.filter(start=t0, stop=t1,
+                                                                                for_smoothing=True)
+
+        # Measurements used at each step of the filter, and the steps of the gap
+        z = data.loc[time].values
+        gap_steps = np.flatnonzero(np.isnan(z))
+        gap_start = gap_steps[0]
+        gap_stop = gap_steps[-1] + 1
+        self.assertTrue(gap_start >= 5 and gap_stop + 5 < len(time),
+                        "The gap must be surrounded by steps with measurements")
+        self.assertEqual(gap_stop - gap_start, len(gap_steps), "The steps of the gap must be contiguous")
+
+        # The estimations are finite, also during the gap
+        self.assertTrue(np.isfinite(x).all(), "The estimated states must be finite")
+        self.assertTrue(np.isfinite(sqrtP).all(), "The covariance of the estimated states must be finite")
+
+        # Without measurements the covariance of the state grows
+        # (the increase becomes small when it approaches its steady state value)
+        std_x = np.abs(sqrtP[:, 0, 0])
+        self.assertTrue(std_x[gap_start] > std_x[gap_start - 1],
+                        "The covariance of the state has to increase when the measurements are missing")
+        self.assertTrue(np.all(np.diff(std_x[gap_start - 1:gap_stop]) > -1e-6),
+                        "The covariance of the state cannot decrease when the measurements are missing")
+        self.assertTrue(std_x[gap_stop - 1] > np.max(std_x[gap_start - 5:gap_start]),
+                        "The covariance of the state at the end of the gap has to be higher than before it")
+
+        # The steps with measurements, before and after the gap, are the basic UKF steps
+        for k in [1, gap_start - 1, gap_stop, gap_stop + 5]:
+            x_k, sqrtP_k, y_k, Sy_k, y_full_k, x_full_k = ukf_FMU.ukf_step(x[k - 1], sqrtP[k - 1], sqrt_Q, sqrt_R,
+                                                                           time[k - 1], time[k], z[k:k + 1])
+            np.testing.assert_almost_equal(x_k, x[k], 8,
+                                           "The state estimated at step {0} is not the one of ukf_step".format(k))
+            np.testing.assert_almost_equal(sqrtP_k, sqrtP[k], 8,
+                                           "The covariance estimated at step {0} is not the one of ukf_step".format(k))
+            np.testing.assert_almost_equal(y_k, y[k], 8,
+                                           "The output estimated at step {0} is not the one of ukf_step".format(k))
+
+        return
+
     def test_ukf_smoother_valve(self):
         """
         This method tests the state and parameter estimation on the valve example performed
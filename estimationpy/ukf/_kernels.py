@@ -0,0 +1,112 @@
+"""
+This module contains the numeric kernels used by
+:class:`estimationpy.ukf.ukf_fmu.UkfFmu` to compute the weighted
+covariance matrices of the sigma points.
+
+Each kernel fuses the subtraction of the average, the multiplication by the
+weights and the accumulation of the outer products in a single pass over the
+sigma points. The kernels are compiled with **numba** when it is available,
+see :mod:`estimationpy.utils.jit`; the rows of the result are computed in parallel.
+
+The sigma points of a diverged simulation may contain NaN or infinite values, that
+have to propagate to the covariance matrices so the filter can detect them. For this
+reason the kernels do not use the fast math flags ``nnan`` and ``ninf``.
+"""
+import numpy as np
+
+from estimationpy.utils.jit import njit, prange
+
+
+@njit(cache=True, parallel=True, fastmath={"nsz", "arcp", "contract", "afn", "reassoc"})
+def weighted_outer(X, mu, wc, Q):
+    """
+    This function computes the symmetric matrix
+
+    .. math::
+
+        Q + \\sum_{i} w_c^{(i)} \\left ( \\mathbf{x}^{(i)} - \\boldsymbol{\\mu} \\right )^T
+        \\left ( \\mathbf{x}^{(i)} - \\boldsymbol{\\mu} \\right )
+
+    where :math:`\\mathbf{x}^{(i)}` is the i-th row of ``X``. Only the upper
+    triangle is accumulated, then it is mirrored.
+
+    :param numpy.ndarray X: matrix with one sigma point for each row, shape ``(n, d)``
+    :param numpy.ndarray mu: the average of the sigma points, shape ``(d,)``
+    :param numpy.ndarray wc: the weights of the sigma points, shape ``(n,)``
+    :param numpy.ndarray Q: matrix with shape ``(d, d)`` added to the result, it is not modified
+
+    :return: the weighted covariance matrix with shape ``(d, d)``
+    :rtype: numpy.ndarray
+    """
+    n, d = X.shape
+    out = Q.copy()
+    for a in prange(d):
+        for i in range(n):
+            t = wc[i] * (X[i, a] - mu[a])
+            for b in range(a, d):
+                out[a, b] += t * (X[i, b] - mu[b])
+    for a in range(d):
+        for b in range(a + 1, d):
+            out[b, a] = out[a, b]
+    return out
+
+
+@njit(cache=True, parallel=True, fastmath={"nsz", "arcp", "contract", "afn", "reassoc"})
+def weighted_cross(X, mu_x, Y, mu_y, wc):
+    """
+    This function computes the cross covariance matrix
+
+    .. math::
+
+        \\sum_{i} w_c^{(i)} \\left ( \\mathbf{x}^{(i)} - \\boldsymbol{\\mu}_x \\right )^T
+        \\left ( \\mathbf{y}^{(i)} - \\boldsymbol{\\mu}_y \\right )
+
+    where :math:`\\mathbf{x}^{(i)}` and :math:`\\mathbf{y}^{(i)}` are the i-th rows
+    of ``X`` and ``Y``.
+
+    :param numpy.ndarray X: matrix with one sigma point for each row, shape ``(n, d)``
+    :param numpy.ndarray mu_x: the average of the rows of ``X``, shape ``(d,)``
+    :param numpy.ndarray Y: matrix with one sigma point for each row, shape ``(n, m)``
+    :param numpy.ndarray mu_y: the average of the rows of ``Y``, shape ``(m,)``
+    :param numpy.ndarray wc: the weights of the sigma points, shape ``(n,)``
+
+    :return: the weighted cross covariance matrix with shape ``(d, m)``
+    :rtype: numpy.ndarray
+    """
+    n, d = X.shape
+    m = Y.shape[1]
+    out = np.zeros((d, m))
+    for a in prange(d):
+        for i in range(n):
+            t = wc[i] * (X[i, a] - mu_x[a])
+            for b in range(m):
+                out[a, b] += t * (Y[i, b] - mu_y[b])
+    return out
+
+
+@njit(cache=True, fastmath={"nsz", "arcp", "contract", "afn", "reassoc"})
+def chol_update_kernel(Lc, X, sign0):
+    """
+    This function computes in place the Cholesky update (``sign0 > 0``) or downdate
+    (``sign0 < 0``) of the upper triangular matrix ``Lc`` with all the columns of ``X``,
+    as done by :func:`estimationpy.ukf.ukf_fmu.UkfFmu.chol_update`.
+    Both ``Lc`` and ``X`` are modified. The fast math flags that assume the absence of
+    NaN and infinite values are not used, because the caller checks the result for them.
+
+    :param numpy.ndarray Lc: the upper triangular matrix to update, shape ``(n, n)``
+    :param numpy.ndarray X: the vectors used for the update, one for each column, shape ``(n, m)``
+    :param float sign0: the sign of the weight associated to the vectors
+    """
+    row, col = X.shape
+    for j in range(col):
+        for k in range(row):
+            Lkk = Lc[k, k]
+            xk = X[k, j]
+            rr_arg = Lkk * Lkk + sign0 * xk * xk
+            rr = 1e-8 if rr_arg < 0 else np.sqrt(rr_arg)
+            c = rr / Lkk
+            s = xk / Lkk
+            Lc[k, k] = rr
+            for m in range(k + 1, row):
+                Lc[k, m] = (Lc[k, m] + sign0 * s * X[m, j]) / c
+                X[m, j] = c * X[m, j] - s * Lc[k, m]
@@ -1,10 +1,12 @@
 import os
 import numpy as np
-import pandas as pd
 import multiprocessing
-import calendar
+from scipy.linalg import cholesky as _chol, cho_solve, qr as _qr
+from scipy.linalg.blas import dsyrk
 
 from estimationpy.fmu_utils.fmu_pool import FmuPool
+from estimationpy.utils.jit import HAS_NUMBA
+from estimationpy.ukf._kernels import weighted_outer, weighted_cross, chol_update_kernel
 
 import logging
 logger = logging.getLogger(__name__)
@@ -12,6 +14,50 @@ logger = logging.getLogger(__name__)
 class UkfException(Exception):
     pass
 
+def _constraint_array(value, dtype):
+    """
+    This function converts the flags or the thresholds of a constraint into a
+    read only **numpy.ndarray** with the given type. The array is read only
+    because the bounds used by the filter are computed from it, and modifying
+    its elements in place would not update them.
+    
+    :param value: list or array with the flags or the thresholds
+    :param dtype: type of the elements of the array
+    :return: the read only array
+    :rtype: numpy.ndarray
+    """
+    arr = np.array(value, dtype = dtype)
+    arr.flags.writeable = False
+    return arr
+
+def _constraint_property(name, dtype, doc):
+    """
+    This function creates a property for the flags or the thresholds of a
+    constraint of :class:`UkfFmu`. When a new value is assigned, the bounds
+    used by the filter are computed again.
+    
+    :param str name: name of the attribute, the value is stored in ``_<name>``
+    :param dtype: type of the elements of the array
+    :param str doc: docstring of the property
+    :return: the property
+    :rtype: property
+    """
+    attr = "_" + name
+    
+    def fget(self):
+        return getattr(self, attr)
+    
+    def fset(self, value):
+        arr = _constraint_array(value, dtype)
+        if arr.shape != getattr(self, attr).shape:
+            msg = "The value of {0} must have shape {1}, provided is {2}".format(name, getattr(self, attr).shape, arr.shape)
+            logger.error(msg)
+            raise ValueError(msg)
+        setattr(self, attr, arr)
+        self.__set_constraint_bounds__()
+    
+    return property(fget, fset, doc = doc)
+
 
 class UkfFmu:
     """
@@ -32,7 +78,7 @@ class UkfFmu:
 
     """
     
-    def __init__(self, model, n_proc = multiprocessing.cpu_count() - 1):
+    def __init__(self, model, n_proc = multiprocessing.cpu_count() - 1, persistent_pool = False):
         """
         Constructor of the class that initializes an object that can be used to solve
         state and parameter estimation problems by using the UKF and smoothing algorithms.
@@ -55,6 +101,12 @@ class UkfFmu:
           when the simulations are run. Make sure this value is equal to 1 if the filtering or smoothing
           are executed as part of a Celery task. By default this value is equal to the number of 
           available processors minus one.
+        :param bool persistent_pool: if True, the simulations of the sigma points are run by
+          persistent workers that keep their own instance of the FMU across the steps of the filter,
+          see :class:`estimationpy.fmu_utils.fmu_pool.FmuPool`. By default a new process is created
+          for each simulation. The workers are created again every time the model changes, e.g.,
+          when a parameter that is not estimated is set with
+          :func:`estimationpy.fmu_utils.model.Model.set_real`. Call :func:`close` to terminate them.
                 
         :raises ValueError: The method raises an exception if the model associated to the filter
           does not have state or parameters to be estimated.
@@ -69,7 +121,7 @@ class UkfFmu:
         self.model = model
         
         # Instantiate the pool that will run the simulation in parallel
-        self.pool = FmuPool(self.model, processes = n_proc)
+        self.pool = FmuPool(self.model, processes = n_proc, persistent = persistent_pool)
         
         # Set the number of states variables (total and observed), parameters estimated and outputs
         self.n_state = self.model.get_num_states()
@@ -99,21 +151,90 @@ class UkfFmu:
         # define UKF parameters with default values
         self.set_ukf_params()
         
-        # set the default constraints for the observed state variables (not active by default)
-        self.constrStateHigh = self.model.get_constr_obs_states_high()
-        self.constrStateLow = self.model.get_constr_obs_states_low()
+        # workspace used by the method square_root
+        self._chol_workspace = np.empty((self.N, self.N), order = "F")
+        
+        # precision of the square root covariance matrices, see set_dtype. By default
+        # double precision is used and the Cholesky updates are always computed in double precision
+        self.dtype = np.float64
+        self.use_double_for_chol_update = True
+        
+        # buffers for the sigma points and their projections, their shapes do not
+        # change during the filtering and smoothing processes. By default they are double precision
+        self.mixed_precision = False
+        self.__allocate_buffers__()
+        
+        # contraction paths used by the method _weighted_einsum, indexed by the shapes of the operands
+        self._einsum_paths = {}
+        
+        # states and parameters coupled to the measured outputs, by default all of them
+        self._state_obs_cols = None
+        
+        # set the default constraints for the observed state variables (not active by default).
+        # The flags and the thresholds are stored as arrays so the constraints can be applied
+        # to all the sigma points at once. The public attributes are properties that update
+        # the bounds of the constraints when a new value is assigned
+        self._constrStateHigh = _constraint_array(self.model.get_constr_obs_states_high(), bool)
+        self._constrStateLow = _constraint_array(self.model.get_constr_obs_states_low(), bool)
         
         # Max and Min Value of the states constraints
-        self.constrStateValueHigh = self.model.get_state_observed_max()
-        self.constrStateValueLow  = self.model.get_state_observed_min()
+        self._constrStateValueHigh = _constraint_array(self.model.get_state_observed_max(), np.float64)
+        self._constrStateValueLow  = _constraint_array(self.model.get_state_observed_min(), np.float64)
         
         # set the default constraints for the estimated parameters (not active by default)
-        self.constrParsHigh = self.model.get_constr_pars_high()
-        self.constrParsLow = self.model.get_constr_pars_low()
+        self._constrParsHigh = _constraint_array(self.model.get_constr_pars_high(), bool)
+        self._constrParsLow = _constraint_array(self.model.get_constr_pars_low(), bool)
         
         # Max and Min Value of the parameters constraints
-        self.constrParsValueHigh = self.model.get_parameters_max()
-        self.constrParsValueLow  = self.model.get_parameters_min()
+        self._constrParsValueHigh = _constraint_array(self.model.get_parameters_max(), np.float64)
+        self._constrParsValueLow  = _constraint_array(self.model.get_parameters_min(), np.float64)
+        
+        # bounds of the states and parameters used by _constrained_state_batch
+        self.__set_constraint_bounds__()
+    
+    def __set_constraint_bounds__(self):
+        """
+        This method combines the flags and the thresholds of the constraints of the observed states
+        and of the estimated parameters into the two vectors ``_state_lo`` and ``_state_hi``, that have
+        one element for each state and parameter estimated. The bounds of the constraints that are not
+        active are -inf (lower bound) and +inf (upper bound), so all the constraints are imposed
+        with a single call to ``numpy.clip``.
+        
+        **Note:**
+        This method is called every time a new value is assigned to one of the attributes
+        ``constrStateHigh``, ``constrStateLow``, ``constrStateValueHigh``, ``constrStateValueLow``,
+        ``constrParsHigh``, ``constrParsLow``, ``constrParsValueHigh``, and ``constrParsValueLow``.
+        The arrays of these attributes are read only, a constraint is modified by assigning a new
+        array to the attribute.
+        """
+        flags_low = np.concatenate((self.constrStateLow, self.constrParsLow))
+        flags_high = np.concatenate((self.constrStateHigh, self.constrParsHigh))
+        values_low = np.concatenate((self.constrStateValueLow, self.constrParsValueLow))
+        values_high = np.concatenate((self.constrStateValueHigh, self.constrParsValueHigh))
+        
+        self._state_lo = np.where(flags_low, values_low, -np.inf)
+        self._state_hi = np.where(flags_high, values_high, np.inf)
+        
+        # When the lower bound is higher than the upper one the lower bound is imposed,
+        # the same result obtained by applying first the upper and then the lower bound
+        np.maximum(self._state_hi, self._state_lo, out = self._state_hi)
+    
+    constrStateHigh = _constraint_property("constrStateHigh", bool,
+        "Flags that activate the upper bounds of the observed states")
+    constrStateLow = _constraint_property("constrStateLow", bool,
+        "Flags that activate the lower bounds of the observed states")
+    constrStateValueHigh = _constraint_property("constrStateValueHigh", np.float64,
+        "Upper bounds of the observed states")
+    constrStateValueLow = _constraint_property("constrStateValueLow", np.float64,
+        "Lower bounds of the observed states")
+    constrParsHigh = _constraint_property("constrParsHigh", bool,
+        "Flags that activate the upper bounds of the estimated parameters")
+    constrParsLow = _constraint_property("constrParsLow", bool,
+        "Flags that activate the lower bounds of the estimated parameters")
+    constrParsValueHigh = _constraint_property("constrParsValueHigh", np.float64,
+        "Upper bounds of the estimated parameters")
+    constrParsValueLow = _constraint_property("constrParsValueLow", np.float64,
+        "Lower bounds of the estimated parameters")
     
     def __str__(self):
         """
@@ -139,6 +260,16 @@ class UkfFmu:
         return string
         
     
+    def close(self):
+        """
+        This method terminates the persistent workers used to run the simulations,
+        if any, see :func:`estimationpy.fmu_utils.fmu_pool.FmuPool.close`.
+        The workers are created again the next time the filter runs a simulation.
+
+        :rtype: None
+        """
+        self.pool.close()
+
     def set_default_ukf_params(self):
         """
         This method initializes the parameters of the UKF to their
@@ -170,6 +301,7 @@ class UkfFmu:
         
         self.lambd    = (self.alpha**2)*(n + self.k) - n
         self.sqrtC    = self.alpha*np.sqrt(n + self.k)
+        self.__set_weight_scalars__()
         
         # compute the weights
         self.compute_weights()
@@ -203,10 +335,23 @@ class UkfFmu:
         
         self.lambd    = (self.alpha**2)*(n + self.k) - n
         self.sqrtC    = self.alpha*np.sqrt(self.k + n)
+        self.__set_weight_scalars__()
         
         # compute the weights
         self.compute_weights()
 
+    def __set_weight_scalars__(self):
+        """
+        This method computes the scalars that define the weights of the sigma points
+        given the parameters of the UKF, i.e., :math:`N + \\lambda`, the weights :math:`w_m^{(0)}`
+        and :math:`w_c^{(0)}` of the central point, and the weight :math:`1/2(N + \\lambda)`
+        shared by all the other points. The scalars are used by :func:`compute_weights`.
+        """
+        self._n_plus_lambd = self.N + self.lambd
+        self._w_side = 1.0/(2.0*self._n_plus_lambd)
+        self._w_m0 = self.lambd/self._n_plus_lambd
+        self._w_c0 = self._w_m0 + (1 - self.alpha**2 + self.beta)
+
     def get_ukf_params(self):
         """
         This method returns a tuple containing the parameters of the UKF.
@@ -250,18 +395,132 @@ class UkfFmu:
         
         n = self.N
         
-        self.W_m = np.zeros((1+2*n, 1))
-        self.W_c = np.zeros((1+2*n, 1))
+        self.W_m = np.full((1+2*n, 1), self._w_side)
+        self.W_c = np.full((1+2*n, 1), self._w_side)
         
-        self.W_m[0,0] = self.lambd/(n + self.lambd)
-        self.W_c[0,0] = self.lambd/(n + self.lambd) + (1 - self.alpha**2 + self.beta)
-
-        for i in range(2*n):
-            self.W_m[i+1,0] = 1.0/(2.0*(n + self.lambd))
-            self.W_c[i+1,0] = 1.0/(2.0*(n + self.lambd))
+        self.W_m[0,0] = self._w_m0
+        self.W_c[0,0] = self._w_c0
+        
+        # row vector of the weights used to compute the averages
+        self._W_m_T = self.W_m.T
+        
+        # square roots and signs of the covariance weights, their products are used to scale
+        # the deviations of the sigma points in _compute_sqrt_cov
+        self._wc_weights = np.sqrt(np.abs(self.W_c[:,0]))
+        self._wc_signs = np.sign(self.W_c[:,0])
+        self._wc_coeff = self._wc_signs*self._wc_weights
 
         return
     
+    def __allocate_buffers__(self):
+        """
+        This method allocates the buffers that contain the sigma points and their projections.
+        The buffers are single precision if the mixed precision mode is enabled, see
+        :func:`set_mixed_precision`, and double precision otherwise.
+        """
+        self._dtype_sig = np.float32 if self.mixed_precision else self.dtype
+        self._Xs = np.empty((self.n_points, self.N), dtype = self._dtype_sig)
+        self._X_proj = np.empty((self.n_points, self.N), dtype = self._dtype_sig)
+        self._Z_proj = np.empty((self.n_points, self.n_outputs), dtype = self._dtype_sig)
+        self._Xfull_proj = np.empty((self.n_points, self.n_state))
+        self._Zfull_proj = np.empty((self.n_points, self.n_outputsTot))
+        
+        # square root of the covariance matrix scaled by sqrtC, used to compute the sigma points
+        self._scaled_sqrtP_buffer = np.empty((self.N, self.N))
+        
+        # matrices factorized by _compute_sqrt_cov, indexed by their shape
+        self._qr_buffers = {}
+    
+    def set_mixed_precision(self, enabled):
+        """
+        This method enables or disables the mixed precision mode of the filter.
+        In mixed precision mode the sigma points and their projections (observed states,
+        parameters and measured outputs) are stored in single precision, which halves the memory
+        they use. The averages, the covariance matrices, their square roots and the
+        Cholesky updates are always computed in double precision.
+        The full states and outputs, that are used to update the model, remain double precision.
+        
+        **Note:**
+        The mode is disabled by default. Single precision has about seven significant digits,
+        so it should not be used when the states or parameters have very different scales or
+        when the estimation requires strict double precision.
+        
+        :param bool enabled: True to enable the mixed precision mode, False to disable it.
+        """
+        self.mixed_precision = bool(enabled)
+        self.__allocate_buffers__()
+    
+    def set_dtype(self, dtype, use_double_for_chol_update = True):
+        """
+        This method defines the floating point type used by the square root form of the filter,
+        i.e., by the square root covariance matrices of the states and of the outputs, by their
+        QR factorizations and by the triangular solves that compute the Kalman gain.
+        The sigma points use the same type, unless the mixed precision mode is enabled
+        (see :func:`set_mixed_precision`).
+        
+        Single precision halves the memory moved by these operations, but it has about seven
+        significant digits. The Cholesky updates are the steps that are most sensitive to the
+        rounding errors, for this reason they are computed in double precision unless
+        ``use_double_for_chol_update`` is False.
+        
+        :param dtype: the floating point type, either ``numpy.float32`` or ``numpy.float64``.
+          The default is ``numpy.float64``.
+        :param bool use_double_for_chol_update: if True the Cholesky updates are computed
+          in double precision regardless of ``dtype``.
+        
+        :raises ValueError: if the type is not single or double precision.
+        """
+        dtype = np.dtype(dtype).type
+        if dtype not in (np.float32, np.float64):
+            msg = "The type must be numpy.float32 or numpy.float64, provided {0}".format(dtype)
+            logger.error(msg)
+            raise ValueError(msg)
+        
+        self.dtype = dtype
+        self.use_double_for_chol_update = bool(use_double_for_chol_update)
+        self.__allocate_buffers__()
+    
+    def set_output_coupling(self, cols = None):
+        """
+        This method defines which of the estimated states and parameters are coupled
+        to the measured outputs. When the coupling is defined the cross covariance matrix
+        computed by :func:`compute_cov_x_y` has zero rows for all the other states and parameters,
+        and these rows are not computed.
+        
+        **Note:**
+        This is an approximation that is valid only if the states and parameters excluded
+        are not correlated with the measured outputs, e.g., parameters that do not influence
+        the outputs during the estimation period. Otherwise the excluded variables are not
+        corrected by the filter. By default all the states and parameters are used.
+        
+        :param cols: the indices of the coupled variables in the vector of estimated states
+          followed by the estimated parameters, or a boolean mask with ``N`` elements.
+          If None all the states and parameters are used.
+        :type cols: list, numpy.ndarray
+        
+        :raises ValueError: if the indices are not within the vector of estimated states
+          and parameters.
+        """
+        if cols is None:
+            self._state_obs_cols = None
+            return
+        
+        cols = np.asarray(cols)
+        if cols.dtype == bool:
+            if cols.shape != (self.N,):
+                msg = "The coupling mask must have {0} elements, provided {1}".format(self.N, cols.shape)
+                logger.error(msg)
+                raise ValueError(msg)
+            cols = np.flatnonzero(cols)
+        
+        cols = np.unique(cols.astype(np.intp))
+        if cols.size > 0 and (cols[0] < 0 or cols[-1] >= self.N):
+            msg = "The indices of the coupled variables must be between 0 and {0}".format(self.N - 1)
+            logger.error(msg)
+            raise ValueError(msg)
+        
+        self._state_obs_cols = cols
+    
     def get_weights(self):
         """
         This method returns a tuple that contains the vectors :math:`\\mathbf{w}_m` and :math:`\\mathbf{w}_c`
@@ -276,9 +535,14 @@ class UkfFmu:
         """
         This method computes the square root of a square matrix :math:`A`.
         The method uses the Cholesky factorization provided by the linear algebra
-        package in **numpy**. The matrix returned is a lower triangular 
+        package in **scipy**. The matrix returned is a lower triangular 
         matrix.
         
+        The matrix :math:`A` is copied into a workspace that is allocated once
+        and reused by the following calls, the factorization is then computed in place
+        without checking for NaN or infinite values. The matrix :math:`A` is not modified,
+        and the matrix returned is a new array that does not share memory with the workspace.
+        
         :param numpy.ndarray A: square matrix :math:`A`
         :return: square root of math:`A`, such that :math:`S S^T = A`. The
           matrix is lower triangular.
@@ -286,8 +550,15 @@ class UkfFmu:
         :rtype: numpy.ndarray
                 
         """
-        sqrtA = np.linalg.cholesky(A)
-        return sqrtA
+        A = np.asarray(A, dtype = float)
+        ws = getattr(self, "_chol_workspace", None)
+        if ws is None or ws.shape != A.shape:
+            # Fortran order allows LAPACK to factorize the matrix in place
+            ws = np.empty(A.shape, order = "F")
+            self._chol_workspace = ws
+        ws[...] = A
+        sqrtA = _chol(ws, lower = True, overwrite_a = True, check_finite = False)
+        return sqrtA.copy()
     
     def constrained_state(self, x_A):
         """
@@ -306,29 +577,35 @@ class UkfFmu:
         if len(x_A) != self.n_state_obs + self.n_pars:
             raise ValueError("The vector provided as input is not correct, desired length is {0}, provided is {1}".format(self.N, len(x_A)))
         
-        # Check for every observed state
-        for i in range(self.n_state_obs):
+        # Lists and integer arrays are converted, float arrays are constrained in place
+        x_A = np.asarray(x_A, dtype = float)
         
-            # if the constraint is active and the threshold is violated
-            if self.constrStateHigh[i] and x_A[i] > self.constrStateValueHigh[i]:
-                x_A[i] = self.constrStateValueHigh[i]
-                
-            # if the constraint is active and the threshold is violated    
-            if self.constrStateLow[i] and x_A[i] < self.constrStateValueLow[i]:
-                x_A[i] = self.constrStateValueLow[i]
-                
-        # Check for every observed state
-        for i in range(self.n_pars):
-        
-            # if the constraint is active and the threshold is violated
-            if self.constrParsHigh[i] and x_A[self.n_state_obs+i] > self.constrParsValueHigh[i]:
-                x_A[self.n_state_obs+i] = self.constrParsValueHigh[i]
-                
-            # if the constraint is active and the threshold is violated    
-            if self.constrParsLow[i] and x_A[self.n_state_obs+i] < self.constrParsValueLow[i]:
-                x_A[self.n_state_obs+i] = self.constrParsValueLow[i]
+        # The vector is seen as a matrix with a single row, the constraints are applied in place
+        self._constrained_state_batch(x_A[np.newaxis, :])
         
         return x_A
+    
+    def _constrained_state_batch(self, X):
+        """
+        This method applies the constraints associated to the state variables and
+        parameters being estimated to all the rows of the matrix :math:`X`, each row
+        is a vector :math:`\\mathbf{x}^A` like the one accepted by :func:`constrained_state`.
+        The matrix is modified in place.
+        
+        :param numpy.ndarray X: matrix with shape ``(M, N)`` where each row contains the states
+          and parameters to be constrained. Matrices that are not floating point are
+          converted and not modified in place
+        :return: the constrained version of :math:`X`
+        :rtype: numpy.ndarray
+        """
+        if not np.issubdtype(np.asarray(X).dtype, np.floating):
+            X = np.asarray(X, dtype = float)
+        
+        # Observed states and estimated parameters, the bounds of the constraints
+        # that are not active are infinite
+        np.clip(X, self._state_lo, self._state_hi, out = X)
+        
+        return X
                 
     def compute_sigma_points(self, x, pars, sqrtP):
         """
@@ -359,7 +636,8 @@ class UkfFmu:
         :param numpy.array pars: vector containing the estimated parameters,
         :param numpy.ndarray sqrtP: square root of the covariance matrix :math:`P`
         :return: a matrix that contains the sigma points, each row is a sigma point that is\
-          a vector of state and parameters to be evaluated.
+          a vector of state and parameters to be evaluated. The matrix is a buffer owned by
+          the filter, it is valid until the next call of this method.
         :rtype: numpy.ndarray
         
         :raises ValueError: The method raises a value error if the input parameters\
@@ -371,7 +649,7 @@ class UkfFmu:
             # reshape the state vector
             x = np.squeeze(x)
             x = x.reshape(1, self.n_state_obs)
-            logger.debug('State vector x reshaped to {}'.format(x.shape))
+            logger.debug('State vector x reshaped to %s', x.shape)
         except ValueError:
             msg = "The vector of state variables has a wrong size"
             msg += "{0} instead of {1}".format(x.shape, self.n_state_obs)
@@ -382,7 +660,7 @@ class UkfFmu:
             # reshape the parameter vector
             pars = np.squeeze(pars)
             pars = pars.reshape(1, self.n_pars)
-            logger.debug('Parameter vector pars reshaped to {}'.format(pars.shape))
+            logger.debug('Parameter vector pars reshaped to %s', pars.shape)
         except ValueError:
             msg = "The vector of parameters has a wrong size"
             msg += "{0} instead of {1}".format(pars.shape, self.n_pars)
@@ -398,7 +676,8 @@ class UkfFmu:
         #      ....
         #  [0.0, 0.0, 0.0]]
         
-        Xs = np.zeros((self.n_points, self.n_state_obs + self.n_pars))
+        # All the rows of the buffer are overwritten below
+        Xs = self._Xs
 
         # Now using the sqrtP matrix that is lower triangular:
         # create the sigma points by adding and subtracting the rows of the matrix sqrtP, to the lines of Xs
@@ -410,36 +689,22 @@ class UkfFmu:
             
         Xs[0,:] = xs0
         
-        i = 1
         N = self.N
-        for row in sqrtP:
-            Xs[i,:]   = xs0
-            Xs[i+N,:] = xs0
-            
-            nso = self.n_state_obs
-            ns  = nso
-            npa = self.n_pars
-            
-            try:
-                
-                Xs[i,  0:nso] += self.sqrtC*row[0:nso]
-                Xs[i,  ns:ns+npa] += self.sqrtC*row[ns:]
-                
-                Xs[i+N,  0:nso] -= self.sqrtC*row[0:nso]
-                Xs[i+N,  ns:] -= self.sqrtC*row[ns:]
-                    
-            except ValueError:
-                msg = "Is not possible to generate the sigma points..."
-                msg +="\nthe dimensions of the sqrtP matrix and the state and parameter vectors are not compatible"
-                msg +="\n {0} and {1}".format(sqrtP.shape, Xs.shape)
-                logger.exception(msg)
-                raise ValueError(msg)
-            
-            # Introduce constraints on points
-            Xs[i,:] = self.constrained_state(Xs[i,:])
-            Xs[i+N,:] = self.constrained_state(Xs[i+N,:])
-            
-            i += 1
+        if np.shape(sqrtP) != (N, N):
+            msg = "Is not possible to generate the sigma points..."
+            msg +="\nthe dimensions of the sqrtP matrix and the state and parameter vectors are not compatible"
+            msg +="\n {0} and {1}".format(np.shape(sqrtP), Xs.shape)
+            logger.error(msg)
+            raise ValueError(msg)
+        
+        # The rows 1..N are obtained adding the scaled rows of sqrtP, the rows N+1..2N
+        # subtracting them
+        scaled = np.multiply(self.sqrtC, sqrtP, out = self._scaled_sqrtP_buffer)
+        np.add(xs0, scaled, out = Xs[1:N+1,:])
+        np.subtract(xs0, scaled, out = Xs[N+1:,:])
+        
+        # Introduce constraints on points
+        self._constrained_state_batch(Xs[1:,:])
         
         return Xs
 
@@ -461,55 +726,59 @@ class UkfFmu:
           * the full projected states (both estimated and not),
           * the full projected outputs (either measured or not).
         
+          When all the sigma points are projected the arrays are buffers owned by
+          the filter, they are valid until the next call of this method.
+        
         :rtype: tuple
         
+        :raises UkfException: if the simulations of some sigma points fail twice.
+        
         **Note:**
-        If for any reason the results of the simulation pool is an empty dictionary,
-        the method tries again to run the simulations up to the maximum number
-        of simulations allowed ``MAX_RUN``. By default ``MAX_RUN = 2``.
+        If for any reason the results of some simulations are not available,
+        the method runs again only the simulations of those sigma points. If they fail again
+        the method raises an exception that reports their indices.
                 
         """
+        x_A = np.atleast_2d(x_A)
         row, col = np.shape(x_A)
-        
-        # initialize the vector of the NEW STATES
-        X_proj = np.zeros((row, self.n_state_obs + self.n_pars))
-        Z_proj = np.zeros((row, self.n_outputs))
-        Xfull_proj = np.zeros((row, self.n_state))
-        Zfull_proj = np.zeros((row, self.n_outputsTot))
-        
-        # from the sigma points, get the value of the states and parameters
-        values = []
-        for sigma in x_A:
-            x = sigma[0:self.n_state_obs]
-            pars = sigma[self.n_state_obs:self.n_state_obs+self.n_pars]
-            temp = {"state":x, "parameters":pars}
-            values.append(temp)
-
-        # Run simulations in parallel, if the results are not provided run again until the
-        # maximum number of run is reached
-        MAX_RUN = 2
-        runs = 0
-        poolResults = self.pool.run(values, start = t_old, stop = t)
-        while poolResults == {} and runs < MAX_RUN:
-            poolResults = self.pool.run(values, start = t_old, stop = t)
-        
-        i = 0
-        for r in poolResults:
-            time, results = r[0]
-            
-            X  = results["__ALL_STATE__"]
-            Xo = results["__OBS_STATE__"]
-            p  = results["__PARAMS__"]
-            o  = results["__OUTPUTS__"]
-            o_all = results["__ALL_OUTPUTS__"]
-            
-            Xfull_proj[i,:] = X
-            X_proj[i,0:self.n_state_obs] = Xo
-            X_proj[i,self.n_state_obs:self.n_state_obs+self.n_pars] = p
-            Z_proj[i,:] = o
-            Zfull_proj[i,:] = o_all
+        nso = self.n_state_obs
+        
+        # initialize the vector of the NEW STATES, the buffers are reused when
+        # all the sigma points are projected
+        if row == self.n_points:
+            X_proj = self._X_proj
+            Z_proj = self._Z_proj
+            Xfull_proj = self._Xfull_proj
+            Zfull_proj = self._Zfull_proj
+        else:
+            X_proj = np.zeros((row, self.n_state_obs + self.n_pars))
+            Z_proj = np.zeros((row, self.n_outputs))
+            Xfull_proj = np.zeros((row, self.n_state))
+            Zfull_proj = np.zeros((row, self.n_outputsTot))
+        
+        # Run simulations in parallel, the states and parameters of the sigma points
+        # are passed as two matrices
+        X, Xo, p, o, o_all = self.pool.run_batch(x_A[:, :nso], x_A[:, nso:], start = t_old, stop = t)
+        
+        # The simulations whose results are not available are run again once
+        missing = np.flatnonzero(np.isnan(np.hstack((Xo, p))).all(axis = 1))
+        if missing.size > 0:
+            logger.warning("Simulations of the sigma points %s failed, try again", missing)
+            retry = self.pool.run_batch(x_A[missing, :nso], x_A[missing, nso:], start = t_old, stop = t)
+            for a, r in zip((X, Xo, p, o, o_all), retry):
+                a[missing] = r
             
-            i += 1
+            missing = np.flatnonzero(np.isnan(np.hstack((Xo, p))).all(axis = 1))
+            if missing.size > 0:
+                msg = "Not possible to project the sigma points {0} from {1} to {2}".format(missing, t_old, t)
+                logger.error(msg)
+                raise UkfException(msg)
+        
+        Xfull_proj[:] = X
+        X_proj[:, :nso] = Xo
+        X_proj[:, nso:] = p
+        Z_proj[:] = o
+        Zfull_proj[:] = o_all
             
         return X_proj, Z_proj, Xfull_proj, Zfull_proj
 
@@ -520,17 +789,31 @@ class UkfFmu:
         the measured outputs. The weigths vetcor used is :math:`\\mathbf{w}_m`.
         
         :param np.ndarray x: the vector to average :math:`\\mathbf{x}`
-        :return: the average of the vector computed as :math:`\\mathbf{w}_m^T \\mathbf{x}`
+        :return: the average of the vector computed as :math:`\\mathbf{w}_m^T \\mathbf{x}`.
+          The average is always a row vector with shape ``(1, m)``.
         :rtype: numpy.ndarray
         
         """
         # make sure that the shape is [1+2*n, ...]
-        x.reshape(self.n_points, -1)
+        x = np.reshape(x, (self.n_points, -1))
         
         # dot product of the two matrices
-        avg = np.dot(self.W_m.T, x)
+        avg = np.dot(self._W_m_T, x)
         
         return avg
+    
+    def _weighted_mean(self, x):
+        """
+        This function computes the weighted mean of the projections of the sigma points,
+        like :func:`average_proj`, but it returns the mean as a vector with shape ``(m,)``.
+        It is used when only the mean vector is needed, e.g., for the full state of the model.
+        
+        :param np.ndarray x: the projections of the sigma points, one per row
+        :return: the average of the projections computed as :math:`\\mathbf{w}_m^T \\mathbf{x}`.
+        :rtype: numpy.ndarray
+        
+        """
+        return np.dot(self._W_m_T[0], np.reshape(x, (self.n_points, -1)))
 
     def compute_P(self, x, x_avg, Q):
         """
@@ -546,6 +829,8 @@ class UkfFmu:
         among the different sigma points.
         The method removes the not observed states from :math:`\\mathbf{x}` and computes
         the covariance matrix :math:`\\mathbf{P}`.
+        When **numba** is installed the computation uses the compiled kernel
+        :func:`estimationpy.ukf._kernels.weighted_outer`, otherwise it uses :func:`_weighted_syrk`.
 
         :param numpy.array x: vector that conatins the estimated states of the system as well
           the estimated parameters. This vector can be seen as the propagated sigma points.
@@ -553,16 +838,52 @@ class UkfFmu:
         :param numpy.ndarray Q: covariance matrix
 
         """
-        # create a diagonal matrix containing the weights
-        W = np.diag(self.W_c[:,0]).reshape(self.n_points, self.n_points)
+        if HAS_NUMBA:
+            # the subtraction of the average, the weighting and the products are
+            # fused in a single compiled kernel
+            return weighted_outer(np.ascontiguousarray(x, dtype = float), np.ravel(x_avg).astype(float),
+                                  self.W_c[:,0], np.asarray(Q, dtype = float))
         
-        # subtract each sigma point with the average x_avg, and tale just the augmented state
-        V = x - x_avg
+        # subtract each sigma point with the average x_avg, and tale just the augmented state.
+        # The sigma points may be single precision, the covariance is always double precision
+        V = np.asarray(x, dtype = np.float64) - x_avg
         
         # compute the new covariance matrix
-        Pnew = np.dot(np.dot(V.T, W), V) + Q
+        Pnew = self._weighted_syrk(V) + Q
         return Pnew
         
+    def _weighted_syrk(self, V):
+        """
+        This method computes the weighted sum of the outer products of the rows of :math:`V`
+        
+        .. math::
+        
+            \\sum_{i=0}^{2n+1} w_c^{(i)} \\mathbf{v}^{(i)} \\mathbf{v}^{(i)T} = V^T \\text{diag}(\\mathbf{w}_c) V
+        
+        The result is symmetric, so it is computed with the BLAS routine **dsyrk** that evaluates
+        only its upper triangle. Since **dsyrk** requires a positive coefficient, the rows associated
+        to positive and negative weights are scaled by the square root of the absolute value of the
+        weights and processed separately.
+        
+        :param numpy.ndarray V: matrix with one row for each sigma point
+        :return: the symmetric matrix :math:`V^T \\text{diag}(\\mathbf{w}_c) V`
+        :rtype: numpy.ndarray
+        """
+        w = self.W_c[:,0]
+        pos = w >= 0
+        
+        # Rank-k update with the positive weights
+        Vp = V[pos]*np.sqrt(w[pos])[:, np.newaxis]
+        C = dsyrk(1.0, Vp, trans = 1)
+        
+        # Rank-k downdate with the negative weights
+        if not np.all(pos):
+            Vn = V[~pos]*np.sqrt(-w[~pos])[:, np.newaxis]
+            C = C - dsyrk(1.0, Vn, trans = 1)
+        
+        # Only the upper triangle is computed, mirror it
+        return np.triu(C) + np.triu(C, 1).T
+        
     def compute_cov_y(self, y, y_avg, R):
         """
         This method computes the output covariance matrix :math:`C_y`
@@ -584,13 +905,13 @@ class UkfFmu:
         :rtype: numpy.ndarray
                 
         """
-        W = np.diag(self.W_c[:,0]).reshape(self.n_points, self.n_points)
-
-        V =  np.zeros(y.shape)
-        for j in range(self.n_points):
-            V[j,:]   = y[j,:] - y_avg[0]
+        if HAS_NUMBA:
+            return weighted_outer(np.ascontiguousarray(y, dtype = float), np.ravel(y_avg).astype(float),
+                                  self.W_c[:,0], np.asarray(R, dtype = float))
         
-        covY = np.dot(np.dot(V.T,W),V) + R
+        V = np.asarray(y, dtype = np.float64) - np.reshape(y_avg, (1, -1))
+        
+        covY = self._weighted_syrk(V) + R
         
         return covY
     
@@ -615,22 +936,57 @@ class UkfFmu:
         :param numpy.array y: vector containing the measured outputs
         :param numpy.array y_avg: vector containing the average of the measured outputs
         
+        If the states and parameters coupled to the measured outputs have been defined with
+        :func:`set_output_coupling`, only the rows of :math:`C_{xy}` associated to them are
+        computed and the others are equal to zero.
+        
         :returns: state-outputs covariance matrix :math:`C_{xy}`
         :rtype: numpy.ndarray
                 
         """
-        W = np.diag(self.W_c[:,0]).reshape(self.n_points, self.n_points)
-            
-        Vx = x - x_avg
+        cols = self._state_obs_cols
+        if cols is not None:
+            # Only the coupled states and parameters are used
+            x = np.asarray(x)[:, cols]
+            x_avg = np.ravel(x_avg)[cols]
+        
+        if HAS_NUMBA:
+            covXY = weighted_cross(np.ascontiguousarray(x, dtype = float), np.ravel(x_avg).astype(float),
+                                   np.ascontiguousarray(y, dtype = float), np.ravel(y_avg).astype(float),
+                                   self.W_c[:,0])
+        else:
+            Vx = x - x_avg
+            Vy = y - np.reshape(y_avg, (1, -1))
         
-        Vy = np.zeros(y.shape)
-        for j in range(self.n_points):
-            Vy[j,:]   = y[j,:] - y_avg[0]
-    
-        covXY = np.dot(np.dot(Vx.T,W),Vy)
+            covXY = self._weighted_einsum(Vx, Vy)
+        
+        if cols is not None:
+            covXY_red = covXY
+            covXY = np.zeros((self.N, covXY_red.shape[1]))
+            covXY[cols, :] = covXY_red
         
         return covXY
     
+    def _weighted_einsum(self, Vx, Vy):
+        """
+        This method computes the weighted cross product :math:`V_x^T \\text{diag}(\\mathbf{w}_c) V_y`
+        with a single call of **numpy.einsum**. The contraction path is computed by
+        **numpy.einsum_path** the first time a given combination of shapes is used, and then
+        it is reused by the following calls.
+        
+        :param numpy.ndarray Vx: matrix with one row for each sigma point
+        :param numpy.ndarray Vy: matrix with one row for each sigma point
+        :return: the matrix :math:`V_x^T \\text{diag}(\\mathbf{w}_c) V_y`
+        :rtype: numpy.ndarray
+        """
+        w = self.W_c[:,0]
+        key = (Vx.shape, Vy.shape)
+        path = self._einsum_paths.get(key)
+        if path is None:
+            path = np.einsum_path('ij,i,ik->jk', Vx, w, Vy, optimize = 'greedy')[0]
+            self._einsum_paths[key] = path
+        return np.einsum('ij,i,ik->jk', Vx, w, Vy, optimize = path)
+    
     def compute_cov_x_x(self, x_new, x_new_avg, x, x_avg):
         """
         This method computes the state-state cross covariance matrix :math:`C_{xx}`.
@@ -655,12 +1011,10 @@ class UkfFmu:
         :rtype: numpy.ndarray
                 
         """
-        W = np.diag(self.W_c[:,0]).reshape(self.n_points,self.n_points)
-            
         Vx_new = x_new - x_new_avg
         Vx  = x - x_avg
     
-        covXX = np.dot(np.dot(Vx.T,W),Vx_new)
+        covXX = self._weighted_einsum(Vx, Vx_new)
         
         return covXX
     
@@ -691,14 +1045,13 @@ class UkfFmu:
         :rtype: numpy.ndarray
                 
         """
-        W = np.diag(self.W_c[:,0]).reshape(self.n_points,self.n_points)
-        x_ave_next = self.average_proj(X_next)  # TODO: check
-        x_ave_now  = self.average_proj(X_now)  # TODO: check
+        x_ave_next = self.average_proj(x_new)
+        x_ave_now  = self.average_proj(x)
         
-        Vnext = X_next - x_ave_next  # TODO: check
-        Vnow  = X_now - x_ave_now  # TODO: check
+        Vnext = x_new - x_ave_next
+        Vnow  = x - x_ave_now
     
-        Cxx = np.dot(np.dot(Vnext.T, W), Vnow)
+        Cxx = self._weighted_einsum(Vnext, Vnow)
         return Cxx
     
     def compute_S(self, x_proj, x_ave, sqrt_Q, w = None):
@@ -707,6 +1060,12 @@ class UkfFmu:
         combined with a Cholesky update.
         The matrix returned by this method is upper triangular.
         
+        The method implements the square root form of the UKF: the square root :math:`S`
+        of the state covariance matrix, such that :math:`S^T S = P`, is computed directly from
+        the weighted deviations of the sigma points and the square root of the process
+        covariance matrix, without building :math:`P` and computing its Cholesky factorization.
+        The computation is done by :func:`_compute_sqrt_cov`.
+        
         :param numpy.array x_proj: projected full state vector
         :param numpy.array x_avg: average of the full state vector
         :param numpy.ndarray sqrt_Q: square root process covariance matrix
@@ -719,46 +1078,13 @@ class UkfFmu:
         :rtype: nunmpy.ndarray
 
         """
-        x_proj_obs = x_proj
-        x_ave_obs = x_ave
-        
-        # Matrix of weights and signs of the weights
-        if w == None:
-            weights = np.sqrt(np.abs(self.W_c[:,0]))
-            signs   = np.sign(self.W_c[:,0])
-        else:
-            weights = np.sqrt(np.abs(w))
-            signs   = np.sign(w)
-        
-        # create matrix A that contains the error between the sigma points and the average
-        A     = np.array([[]])
-        i     = 0
-        for x in x_proj_obs:
-            error = signs[i]*weights[i]*(x - x_ave_obs)
-            
-            # ignore when i==0, this will be done in the update
-            if i == 1:
-                A = error.T
-            elif i > 1:
-                A = np.hstack((A, error.T))
-            i += 1
-
-        # Put on the side the matrix sqrt_Q, that have to be modified to fit the dimension of the augmenets state    
-        A = np.hstack((A, sqrt_Q))
-        
-        # QR factorization
-        q, L = np.linalg.qr(A.T)
-        
-        # Execute Cholesky update
-        x = signs[0]*weights[0]*(x_proj_obs[0,] - x_ave_obs)
-        L = self.chol_update(L, x.T, self.W_c[:,0])
-        
-        return L
+        return self._compute_sqrt_cov(x_proj, x_ave, sqrt_Q, w)
         
     def compute_S_y(self, y_proj, y_ave, sqrt_R):
         """
         This method computes the squared root covariance matrix using the QR decomposition
         combined with a Cholesky update.
+        The computation is done by :func:`_compute_sqrt_cov`.
         
         :param numpy.array y_proj: projected measured output vector
         :param numpy.array y_avg: average of the measured output vector
@@ -768,33 +1094,115 @@ class UkfFmu:
         :rtype: nunmpy.ndarray
 
         """
-        # Matrix of weights and signs of the weights
-        weights = np.sqrt( np.abs(self.W_c[:,0]) )
-        signs   = np.sign( self.W_c[:,0] )
-        
-        # create matrix A that contains the error between the sigma points outputs and the average
-        A     = np.array([[]])
-        i     = 0
-        for y in y_proj:
-            error = signs[i]*weights[i]*(y - y_ave)
-            if i == 1:
-                A = error.T
-            elif i > 1:
-                A = np.hstack((A, error.T))
-            i    += 1
-            
-        # put the square root R matrix on the side
-        A = np.hstack((A, sqrt_R))
+        return self._compute_sqrt_cov(y_proj, y_ave, sqrt_R)
+    
+    def _compute_sqrt_cov(self, proj, ave, sqrt_noise, w = None):
+        """
+        This method computes the upper triangular square root :math:`S` of the covariance matrix
+        of the projected sigma points, such that :math:`S^T S` is the weighted covariance of the
+        projections plus the covariance of the noise. It is used both for the states, see
+        :func:`compute_S`, and for the measured outputs, see :func:`compute_S_y`.
+        
+        The weighted errors of the sigma points and the square root of the noise covariance matrix
+        are factorized with a QR decomposition, then the error of the first sigma point is
+        added with a Cholesky update (or downdate, if its weight is negative).
+        
+        :param numpy.ndarray proj: the projected sigma points, one per row
+        :param numpy.ndarray ave: the average of the projected sigma points
+        :param numpy.ndarray sqrt_noise: the square root of the process or measurement covariance matrix
+        :param numpy.array w: vector that contains the weights to use during the
+          update. If not specified the method uses the weights automatically computed
+          by the filter.
         
-        # QR factorization
-        q, L = np.linalg.qr(A.T)
-
-        # Execute the Cholesky update
-        y = signs[0]*weights[0]*(y_proj[0,] - y_ave)
-        L = self.chol_update(L, y.T, self.W_c[:,0])
+        :return: the upper triangular square root of the covariance matrix
+        :rtype: numpy.ndarray
+        """
+        # Signed square roots of the weights
+        if w is None:
+            w = self.W_c[:,0]
+            coeff = self._wc_coeff
+        else:
+            w = np.ravel(w)
+            coeff = np.sign(w)*np.sqrt(np.abs(w))
+        
+        # create matrix A that contains the error between the sigma points and the average,
+        # each row is scaled by the signed square root of its weight.
+        # The first sigma point is ignored, it will be added by the update.
+        # Put on the side the matrix sqrt_noise, that have to be modified to fit the dimension of the augmenets state
+        A, x = self.__fill_qr_matrix__(proj, ave, sqrt_noise, coeff)
+        
+        # QR factorization, only the factor R is computed and A is overwritten
+        L = _qr(A, mode = 'r', overwrite_a = True, check_finite = False)[0][:A.shape[1]]
+        
+        # Execute Cholesky update, the sign of the first weight defines if it is an update or a downdate
+        L = self.chol_update(L, x.T, w)
         
         return L
     
+    def __fill_qr_matrix__(self, x_proj, x_ave, sqrt_Q, coeff):
+        """
+        This method builds the matrix that is factorized by :func:`_compute_sqrt_cov`.
+        The first rows of the matrix are the errors between the sigma
+        points and the average, each one scaled by the signed square root of its weight,
+        the remaining rows are the transpose of the square root covariance matrix.
+        The error of the first sigma point is used by the Cholesky update and its row
+        is set to zero, a zero row does not change the factor R of the QR factorization.
+        The rows are written in a buffer that is allocated once and reused as long
+        as its shape does not change. The buffer is Fortran ordered, so the QR factorization
+        can overwrite it without making a copy.
+        
+        :param numpy.ndarray x_proj: the projected sigma points, one per row
+        :param numpy.ndarray x_ave: the average of the projected sigma points
+        :param numpy.ndarray sqrt_Q: the square root of the process or measurement covariance matrix
+        :param numpy.array coeff: the signed square roots of the weights, one per sigma point
+        
+        :return: a tuple with the matrix to factorize and the scaled error of the first sigma point,
+          a row vector.
+        :rtype: tuple
+        """
+        n = x_proj.shape[0]
+        d = x_proj.shape[1]
+        shape = (n + sqrt_Q.shape[1], d)
+        
+        A = self._qr_buffers.get(shape)
+        if A is None:
+            A = np.empty(shape, dtype = self.dtype, order = 'F')
+            self._qr_buffers[shape] = A
+        
+        # Errors of all the sigma points, computed with a single subtraction
+        np.subtract(x_proj, x_ave, out = A[:n])
+        np.multiply(A[:n], coeff[:n, np.newaxis], out = A[:n])
+        A[n:] = sqrt_Q.T
+        
+        x = A[:1].copy()
+        A[0] = 0.0
+        
+        return A, x
+    
+    def sqrt_solve(self, S, B):
+        """
+        This method solves the linear system :math:`S^T S X = B`, where :math:`S` is
+        an upper triangular square root matrix like the ones computed by :func:`compute_S` and
+        :func:`compute_S_y`. Since :math:`S` is the Cholesky factor of :math:`S^T S`, the
+        system is solved by ``scipy.linalg.cho_solve`` without factorizing the matrix again,
+        i.e., with two triangular back substitutions instead of a least squares problem.
+        If :math:`S` is singular the method falls back to the least squares solution.
+        
+        :param numpy.ndarray S: the upper triangular square root matrix
+        :param numpy.ndarray B: matrix with the right hand side of the system
+        
+        :return: the solution of the linear system
+        :rtype: numpy.ndarray
+        """
+        # The systems are solved in the precision of S
+        B = np.asarray(B, dtype = S.dtype)
+        if np.all(np.diagonal(S) != 0):
+            return cho_solve((S, False), B)
+        else:
+            logger.warning("The square root matrix is singular, the system is solved with least squares")
+            first_division = np.linalg.lstsq(S.T, B, rcond = None)[0]
+            return np.linalg.lstsq(S, first_division, rcond = None)[0]
+    
     def chol_update(self, L, X, W):
         """
         This method computes the Cholesky update of a matrix.
@@ -809,28 +1217,57 @@ class UkfFmu:
         :rtype: numpy.ndarray
           
         """
-        # Copy the matrix
-        Lc = L.copy()
+        # Precision of the update, see set_dtype
+        dtype = np.float64 if self.use_double_for_chol_update else self.dtype
+        
+        # Copy the matrix, its rows are contiguous
+        Lc = np.array(L, dtype = dtype, order = "C")
         
-        # Compute signs of the weights
-        signs   = np.sign(W)
+        # Copy the vectors, the columns are contiguous and are modified by the update
+        Xc = np.array(X, dtype = dtype, order = "F")
+        
+        # Only the sign of the first weight is used, it defines if it is an update or a downdate
+        sign0   = np.sign(np.ravel(W)[0])
     
         # Start the Cholesky update and do it for every column
         # of matrix X
         
-        (row, col) = X.shape
+        (row, col) = Xc.shape
         
-        for j in range(col):
-            x = X[0:,j]
+        if HAS_NUMBA:
+            # compiled version of the loop below
+            chol_update_kernel(Lc, Xc, float(sign0))
+        else:
+            # Temporary vector used by the in place operations
+            tmp = np.empty(row, dtype = dtype)
+        
+            for j in range(col):
+                x = Xc[:,j]
             
-            for k in range(row):
-                rr_arg    = Lc[k,k]**2 + signs[0]*x[k]**2
-                rr        = 1e-8 if rr_arg < 0 else np.sqrt(rr_arg)
-                c         = rr / Lc[k,k]
-                s         = x[k] / Lc[k,k]
-                Lc[k,k]    = rr
-                Lc[k,k+1:] = (Lc[k,k+1:] + signs[0]*s*x[k+1:])/c
-                x[k+1:]   = c*x[k+1:]  - s*Lc[k, k+1:]
+                for k in range(row):
+                    Lkk       = Lc[k,k]
+                    xk        = x[k]
+                    rr_arg    = Lkk*Lkk + sign0*xk*xk
+                    rr        = 1e-8 if rr_arg < 0 else np.sqrt(rr_arg)
+                    inv_Lkk   = 1.0/Lkk
+                    c         = rr*inv_Lkk
+                    s         = xk*inv_Lkk
+                    Lc[k,k]   = rr
+                
+                    # Views on the trailing part of the row k and of the vector
+                    lck = Lc[k,k+1:]
+                    xt  = x[k+1:]
+                    t   = tmp[:row-k-1]
+                
+                    # Lc[k,k+1:] = (Lc[k,k+1:] + sign0*s*x[k+1:])/c
+                    np.multiply(xt, sign0*s, out = t)
+                    np.add(lck, t, out = lck)
+                    np.divide(lck, c, out = lck)
+                
+                    # x[k+1:] = c*x[k+1:] - s*Lc[k,k+1:]
+                    np.multiply(lck, s, out = t)
+                    np.multiply(xt, c, out = xt)
+                    np.subtract(xt, t, out = xt)
         
         # Check for the presence of any NaN
         if np.any(np.isnan(Lc)):
@@ -839,7 +1276,41 @@ class UkfFmu:
         elif np.any(np.isinf(Lc)):
             return L
         else:
-            return Lc
+            return Lc.astype(self.dtype, copy = False)
+    
+    def chol_downdate(self, S, U):
+        """
+        This method computes the rank-k Cholesky downdate of an upper triangular
+        square root matrix, that is the upper triangular matrix :math:`S_{new}` such that
+
+        .. math::
+            S_{new}^T S_{new} = S^T S - U U^T
+        
+        The matrix :math:`S^T S - U U^T` is computed with a single matrix product and then
+        factorized, instead of applying one rank-1 downdate for each column of :math:`U`.
+        If the matrix is not positive definite the method falls back to the column by column
+        downdate computed by :func:`chol_update`.
+        
+        Forming :math:`S^T S` squares the condition number of :math:`S`, for this reason the
+        matrix is always computed and factorized in double precision, regardless of
+        :func:`set_dtype`. Only the result is converted to the precision of the filter.
+        
+        :param numpy.ndarray S: the upper triangular square root matrix
+        :param numpy.ndarray U: matrix whose columns are the vectors of the downdate
+        
+        :return: the upper triangular square root matrix after the downdate
+        :rtype: numpy.ndarray
+        """
+        # Always double precision, see the note above
+        S_d = np.asarray(S, dtype = np.float64)
+        U_d = np.asarray(U, dtype = np.float64)
+        
+        M = np.dot(S_d.T, S_d) - np.dot(U_d, U_d.T)
+        try:
+            return _chol(M, lower = False).astype(self.dtype, copy = False)
+        except (np.linalg.LinAlgError, ValueError):
+            logger.debug("The rank-k downdate is not positive definite, apply the rank-1 downdates")
+            return self.chol_update(S, U, -1*np.ones(U.shape[1]))
     
     def ukf_step(self, x, sqrtP, sqrtQ, sqrtR, t_old, t, z = None):
         """
@@ -869,8 +1340,86 @@ class UkfFmu:
         
         :rtype: tuple
         """
-        logger.debug("Start UKF startup from {0} to {1}".format(t_old, t))
+        logger.debug("Start UKF startup from %s to %s", t_old, t)
+        
+        # Prediction step
+        x_ave, Snew, X_proj, Z_proj, Zave, Sy, Zfull_ave, Xfull_ave = \
+            self._ukf_predict(x, sqrtP, sqrtQ, sqrtR, t_old, t)
+        
+        # compute the cross covariance matrix
+        CovXZ = self.compute_cov_x_y(X_proj, x_ave, Z_proj, Zave)
+
+        logger.debug("State output covariance matrix is Cxy = %s", CovXZ)
+    
+        # Data assimilation step
+        # The information obtained in the prediction step are corrected with the information
+        # obtained by the measurement of the outputs
+        # In other terms, the Kalman Gain (for the correction) is computed
+        # Sy is upper triangular, the gain is computed with two triangular solves
+        K = self.sqrt_solve(Sy, CovXZ.T)
+        K = K.T
+        
+        # Read the output value
+        if z is None:
+            z = self.model.get_measured_data_ouputs(t)
+
+        logger.debug("Measured output data to be compared agains simulations Z = %s", z)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Error Z - Zave = %s", z.reshape(self.n_outputs,1)-Zave.T)
+        logger.debug("Gain K = %s", K)
+        
+        # State correction using the measurements
+        X_corr = x_ave + np.dot(K,z.reshape(self.n_outputs,1)-Zave.T).T
+        
+        # If constraints are active, they are imposed in order to avoid the corrected value to fall outside
+        self._constrained_state_batch(X_corr[:1,:])
+
+        logger.debug("New state corrected X_corr = %s", X_corr)
+        
+        # The covariance matrix is corrected too
+        U      = np.dot(K,Sy)
+
+        logger.debug("Matrix U = %s", U)
+        logger.debug("Updated covariance matrix Snew = %s", Snew)
+        
+        S_corr = self.chol_downdate(Snew, U)
+
+        logger.debug("New covariance matrix corrected is S_corr = %s", S_corr)
+        
+        # Apply the corrections to the model and then returns
+        # Set observed states and parameters
+        self.model.set_state_selected(X_corr[0,:self.n_state_obs])
+        self.model.set_parameters_selected(X_corr[0,self.n_state_obs:])
+
+        # Remove unnecessary dimension in Zave (Zfull_ave is already a vector),
+        # but do not allow to reduce to 0-d, because it causes troubles when converting arrays into DataFrames
+        Zave = Zave.squeeze()
+        if np.ndim(Zave) == 0:
+            Zave = Zave[np.newaxis]
+
+        return (X_corr[0], S_corr, Zave, Sy, Zfull_ave, Xfull_ave)
+    
+    def _ukf_predict(self, x, sqrtP, sqrtQ, sqrtR, t_old, t):
+        """
+        This method implements the prediction step of the UKF algorithm, that is shared by
+        :func:`ukf_step` and :func:`_ukf_predict_only`. The sigma points are projected from
+        ``t_old`` to ``t``, then the method computes the averages of the projections,
+        the square root of the predicted state covariance matrix and the square root
+        of the output covariance matrix.
+        
+        :param numpy.array x: initial state vector
+        :param numpy.ndarray sqrtP: square root of the state covariance matrix
+        :param numpy.ndarray sqrtQ: square root of the process covariance matrix
+        :param numpy.ndarray sqrtR: square root of the measurements/outputs covariance matrix
+        :param datetime.datetime t_old: initial time for running the simulaiton
+        :param datetime.datetime t: final time for running the simulation
         
+        :return: a tuple with the average of the projected states, the square root of the
+          predicted state covariance matrix, the projected states and measured outputs, the average
+          of the measured outputs, the square root of the output covariance matrix, the average
+          of the complete output vector and the average of the full state vector.
+        :rtype: tuple
+        """
         # Get the parameters and the states to observe
         pars = x[self.n_state_obs:]
         x = x[:self.n_state_obs]
@@ -879,24 +1428,24 @@ class UkfFmu:
         # x, pars, sqrtP, sqrtQ = None, sqrtR = None
         Xs      = self.compute_sigma_points(x, pars, sqrtP)
 
-        logger.debug("Sigma point Xs = {0}".format(Xs))
+        logger.debug("Sigma point Xs = %s", Xs)
     
         # compute the projected (state) points (each sigma point is propagated through the state transition function)
         X_proj, Z_proj, Xfull_proj, Zfull_proj = self.sigma_point_proj(Xs,t_old,t)
 
-        logger.debug("Projected sigma points Xs_proj = {0}".format(X_proj))
+        logger.debug("Projected sigma points Xs_proj = %s", X_proj)
     
         # compute the average
         x_ave = self.average_proj(X_proj)
-        Xfull_ave = self.average_proj(Xfull_proj)
+        Xfull_ave = self._weighted_mean(Xfull_proj)
 
-        logger.debug("Averaged projected sigma points is x_ave = {0}".format(x_ave))
-        logger.debug("Averaged projected full state is Xfull_ave = {0}".format(Xfull_ave))
+        logger.debug("Averaged projected sigma points is x_ave = %s", x_ave)
+        logger.debug("Averaged projected full state is Xfull_ave = %s", Xfull_ave)
         
         # compute the new squared covariance matrix S
-        Snew = self.compute_S(X_proj,x_ave,sqrtQ)
+        Snew = self._compute_sqrt_cov(X_proj, x_ave, sqrtQ)
 
-        logger.debug("New squares S matrix is = {0}".format(Snew))
+        logger.debug("New squares S matrix is = %s", Snew)
         
         # redraw the sigma points, given the new covariance matrix
         # K. ARENDT: THIS STEP SEEMS TO BE UNNECESSARY
@@ -905,9 +1454,9 @@ class UkfFmu:
         # Xs   = self.compute_sigma_points(x, pars, Snew)
 
         # Merge the real full state and the new ones
-        self.model.set_state(Xfull_ave[0])
+        self.model.set_state(Xfull_ave)
 
-        logger.debug("New sigma point is = {0}".format(Xs))
+        logger.debug("New sigma point is = %s", Xs)
 
         # compute the projected (outputs) points (each sigma points is propagated through the state transition function)
         # K. ARENDT: THIS STEP SEEMS TO BE UNNECESSARY. IN ADDITION THERE WAS LIKELY A BUG (SEE BELOW)
@@ -916,74 +1465,62 @@ class UkfFmu:
         # X_proj, Z_proj, Xfull_proj, Zfull_proj = self.sigma_point_proj(Xs,t,t) # Original code
         # X_proj, Z_proj, Xfull_proj, Zfull_proj = self.sigma_point_proj(Xs,t_old,t) # Corrected code
 
-        logger.debug("Output projection of new sigma point is Z_proj = {0}".format(Z_proj))
-        logger.debug("State re-projection is X_proj = {0}".format(X_proj))
+        logger.debug("Output projection of new sigma point is Z_proj = %s", Z_proj)
+        logger.debug("State re-projection is X_proj = %s", X_proj)
         
         # compute the average output
         Zave = self.average_proj(Z_proj)
-        Zfull_ave = self.average_proj(Zfull_proj)
+        Zfull_ave = self._weighted_mean(Zfull_proj)
 
-        logger.debug("Averaged output projection of new sigma points is Zave = {0}".format(Zave))
+        logger.debug("Averaged output projection of new sigma points is Zave = %s", Zave)
 
         # compute the innovation covariance (relative to the output)
-        Sy = self.compute_S_y(Z_proj,Zave,sqrtR)
+        Sy = self._compute_sqrt_cov(Z_proj, Zave, sqrtR)
 
-        logger.debug("Output squared covariance matrix is Sy = {0}".format(Sy))           
+        logger.debug("Output squared covariance matrix is Sy = %s", Sy)           
         
-        # compute the cross covariance matrix
-        CovXZ = self.compute_cov_x_y(X_proj, x_ave, Z_proj, Zave)
-
-        logger.debug("State output covariance matrix is Cxy = {0}".format(CovXZ))
+        return (x_ave, Snew, X_proj, Z_proj, Zave, Sy, Zfull_ave, Xfull_ave)
     
-        # Data assimilation step
-        # The information obtained in the prediction step are corrected with the information
-        # obtained by the measurement of the outputs
-        # In other terms, the Kalman Gain (for the correction) is computed
-        firstDivision = np.linalg.lstsq(Sy.T,CovXZ.T)[0]
-        K             = np.linalg.lstsq(Sy, firstDivision)[0]
-        K             = K.T
+    def _ukf_predict_only(self, x, sqrtP, sqrtQ, sqrtR, t_old, t):
+        """
+        This method executes a step of the UKF algorithm without the correction, it is used
+        when the measurements at time ``t`` are not available (e.g., they contain NaN values).
+        The state and its covariance matrix are the predicted ones, so the method does not
+        compute the cross covariance matrix, the Kalman gain and the downdate of the covariance.
+        The constraints are applied to the predicted state like for the corrected state.
         
-        # Read the output value
-        if z is None:
-            z = self.model.get_measured_data_ouputs(t)
-
-        logger.debug("Measured output data to be compared agains simulations Z = {0}".format(z))
-        logger.debug("Error Z - Zave = {0}".format(z.reshape(self.n_outputs,1)-Zave.T))
-        logger.debug("Gain K = {0}".format(K))
+        The parameters and the values returned are the same of :func:`ukf_step`.
         
-        # State correction using the measurements
-        X_corr = x_ave + np.dot(K,z.reshape(self.n_outputs,1)-Zave.T).T
+        :param numpy.array x: initial state vector
+        :param numpy.ndarray sqrtP: square root of the state covariance matrix
+        :param numpy.ndarray sqrtQ: square root of the process covariance matrix
+        :param numpy.ndarray sqrtR: square root of the measurements/outputs covariance matrix
+        :param datetime.datetime t_old: initial time for running the simulaiton
+        :param datetime.datetime t: final time for running the simulation
         
-        # If constraints are active, they are imposed in order to avoid the corrected value to fall outside
-        X_corr[0,:] = self.constrained_state(X_corr[0,:])
-
-        logger.debug("New state corrected X_corr = {0}".format(X_corr) )
+        :return: a tuple with the predicted state, the square root of the predicted state covariance
+          matrix, the average of the measured outputs, the square root of the output covariance matrix,
+          the average of the complete output vector and the average of the full state vector.
+        :rtype: tuple
+        """
+        logger.debug("Start UKF prediction (without measurements) from %s to %s", t_old, t)
         
-        # The covariance matrix is corrected too
-        U      = np.dot(K,Sy)
-
-        logger.debug("Matrix U = {0}".format(U))
-        logger.debug("Updated covariance matrix Snew = {0}".format(Snew))
+        x_ave, Snew, X_proj, Z_proj, Zave, Sy, Zfull_ave, Xfull_ave = \
+            self._ukf_predict(x, sqrtP, sqrtQ, sqrtR, t_old, t)
         
-        S_corr = self.chol_update(Snew,U,-1*np.ones(self.n_state))
-
-        logger.debug("New covariance matrix corrected is S_corr = {0}".format(S_corr))
+        # The predicted state is not corrected, the constraints are imposed anyway
+        X_pred = np.array(x_ave, dtype = np.float64)
+        self._constrained_state_batch(X_pred)
         
-        # Apply the corrections to the model and then returns
         # Set observed states and parameters
-        self.model.set_state_selected(X_corr[0,:self.n_state_obs])
-        self.model.set_parameters_selected(X_corr[0,self.n_state_obs:])
-
-        # Remove unnecessary dimension in Zave and Zfull_ave,
-        # but do not allow to reduce to 0-d, because it causes troubles when converting arrays into DataFrames
+        self.model.set_state_selected(X_pred[0,:self.n_state_obs])
+        self.model.set_parameters_selected(X_pred[0,self.n_state_obs:])
+        
         Zave = Zave.squeeze()
         if np.ndim(Zave) == 0:
             Zave = Zave[np.newaxis]
-        Zfull_ave = Zfull_ave.squeeze()
-        if np.ndim(Zave) == 0:
-            Zave = Zave[np.newaxis]
-
-        return (X_corr[0], S_corr, Zave, Sy, Zfull_ave, Xfull_ave[0])
+        
+        return (X_pred[0], Snew, Zave, Sy, Zfull_ave, Xfull_ave)
     
     def filter(self, start, stop, sqrt_P = None, sqrt_Q = None, sqrt_R = None, for_smoothing = False):
         """
@@ -1025,14 +1562,20 @@ class UkfFmu:
           * the square root of the process covariance matrix,
           * the square root of the measurements covariance matrix
         
-          **Note:** please note that every vector and matrix returned by this method is a list that
-          contains the vector/matrices for each time stamp of the filtering process.
+          **Note:** please note that every vector and matrix returned by this method is a numpy array
+          whose first dimension is the time stamp of the filtering process, e.g., ``x[i]`` is the
+          vector of estimated states and parameters at the i-th time stamp.
         
         :rtype: tuple
         
         :raises Exception: The method raises an exception if there are problem during the filtering process,
           e.g., numerical problems regarding the estimation.
         """
+        # pandas is needed only by the filtering process, it is imported
+        # here to keep the import of this module light
+        import pandas as pd
+        from estimationpy.fmu_utils.in_out_var import _datetime_index_to_ns
+        
         logger.info("*** Start filtering process...")
         
         # Read the output measured data
@@ -1044,54 +1587,76 @@ class UkfFmu:
         # find the index of the closest matches for start and stop time
         ix_start, ix_stop = self.find_closest_matches(start, stop, time)
 
-        # Initial conditions and other values
-        x     = [np.hstack((self.model.get_state_observed_values(), self.model.get_parameter_values()))]
-        x_full= [self.model.get_state()]
-
-        if sqrt_P == None:
-            sqrt_P = self.model.get_cov_matrix_state_pars()
-        sqrt_Ps = [sqrt_P]
+        # Number of time steps of the filtering process, the estimations are
+        # stored in arrays whose first dimension is the time step
+        n_steps = ix_stop - ix_start
         
-        if sqrt_Q == None:
+        # The square root covariance matrices use the type defined by set_dtype
+        if sqrt_P is None:
+            sqrt_P = self.model.get_cov_matrix_state_pars()
+        if sqrt_Q is None:
             sqrt_Q = self.model.get_cov_matrix_state_pars()
-        if sqrt_R == None:
+        if sqrt_R is None:
             sqrt_R = self.model.get_cov_matrix_outputs()
-
-        y     = [measuredOuts[0,1:]]
-        y_full= [measuredOuts[0,1:]]
-        Sy    = [sqrt_R]
-
-        start_ts = calendar.timegm(time[ix_start].timetuple())
-        final_ts = calendar.timegm(time[ix_stop-1].timetuple())
+        sqrt_P = np.asarray(sqrt_P, dtype = self.dtype)
+        sqrt_Q = np.asarray(sqrt_Q, dtype = self.dtype)
+        sqrt_R = np.asarray(sqrt_R, dtype = self.dtype)
+        
+        x       = np.empty((n_steps, self.N))
+        sqrt_Ps = np.empty((n_steps, self.N, self.N), dtype = self.dtype)
+        y       = np.empty((n_steps, self.n_outputs))
+        Sy      = np.empty((n_steps, self.n_outputs, self.n_outputs), dtype = self.dtype)
+        y_full  = np.empty((n_steps, self.n_outputsTot))
+        x_full  = np.empty((n_steps, self.n_state))
+        
+        # Initial conditions and other values
+        x[0]       = np.hstack((self.model.get_state_observed_values(), self.model.get_parameter_values()))
+        x_full[0]  = self.model.get_state()
+        sqrt_Ps[0] = sqrt_P
+        y[0]       = measuredOuts[0,1:]
+        Sy[0]      = sqrt_R
+
+        # Time stamps in seconds used to print the progress, the progress is printed
+        # at most about 100 times
+        ts = _datetime_index_to_ns(time[ix_start:ix_stop]) // 10**9
+        start_ts = ts[0]
+        final_ts = ts[-1]
+        print_every = max(1, n_steps//100)
 
         for i in range(ix_start+1, ix_stop):
             t_old = time[i-1]
             t = time[i]
             z = measuredOuts[i,1:]
+            k = i - ix_start
 
             # Print progress
-            current_ts = calendar.timegm(t.timetuple())
-            print('[UKF] Step {0}, time = {1} s ({2:.1f}%)'.format(i, current_ts,
-                                                                   100 * float(current_ts-start_ts)
-                                                                   /float(final_ts-start_ts)))
-
-            # Execute a filtering step
+            if k % print_every == 0 or k == n_steps - 1:
+                current_ts = ts[k]
+                print('[UKF] Step {0}, time = {1} s ({2:.1f}%)'.format(i, current_ts,
+                                                                       100 * float(current_ts-start_ts)
+                                                                       /float(final_ts-start_ts)))
+
+            # Execute a filtering step, when the measurements are missing
+            # the measurement update is skipped
             try:
-                X_corr, sP, Zave, S_y, Zfull_ave, X_full = self.ukf_step(x[i-1-ix_start], sqrt_Ps[i-1-ix_start], sqrt_Q, sqrt_R, t_old, t, z)
+                if np.isnan(z).any():
+                    X_corr, sP, Zave, S_y, Zfull_ave, X_full = self._ukf_predict_only(x[k-1], sqrt_Ps[k-1], sqrt_Q, sqrt_R, t_old, t)
+                else:
+                    X_corr, sP, Zave, S_y, Zfull_ave, X_full = self.ukf_step(x[k-1], sqrt_Ps[k-1], sqrt_Q, sqrt_R, t_old, t, z)
             except Exception as e:
                 logger.exception("Exception while running UKF step from {0} to {1}".format(t_old, t))
                 logger.exception(str(e))
-                logger.exception("The state is X = {0}".format(x[i-1-ix_start]))
-                logger.exception("The sqrtP matrix is".format(sqrt_Ps[i-1-ix_start]))
+                logger.exception("The state is X = {0}".format(x[k-1]))
+                logger.exception("The sqrtP matrix is".format(sqrt_Ps[k-1]))
                 raise UkfException("Problem while performing a UKF step")
                 
-            # Add data to the list    
-            x.append(X_corr)
-            sqrt_Ps.append(sP)
-            y.append(Zave)
-            y_full.append(Zfull_ave)
-            Sy.append(S_y)
-            x_full.append(X_full)
+            # Store the results of the step
+            x[k]       = X_corr
+            sqrt_Ps[k] = sP
+            y[k]       = Zave
+            y_full[k]  = Zfull_ave
+            Sy[k]      = S_y
+            x_full[k]  = X_full
         
         # The first of the overall output vector is missing, copy from the second element
         y_full[0] = y_full[1]
@@ -1121,8 +1686,8 @@ class UkfFmu:
           * the square root of the covariance matrix of the estimated states and parameters computed by the smoother,
           * the full outputs of the model computed by the smoother,
         
-          **Note:** please note that every vector and matrix returned by this method is a list that
-          contains the vector/matrices for each time stamp of the filtering process.
+          **Note:** please note that every vector and matrix returned by this method is a numpy array
+          whose first dimension is the time stamp of the filtering process.
         
         :rtype: tuple
         
@@ -1139,10 +1704,11 @@ class UkfFmu:
         nTimeStep = s[0]
         
         # initialize the smoothed states and covariance matrix
-        # the initial value of the smoothed state estimation are equal to the filtered ones
-        Xsmooth = list(X)
-        Ssmooth = list(sqrtP)
-        Yfull_smooth = list(y_full)
+        # the initial value of the smoothed state estimation are equal to the filtered ones.
+        # Like the results of the filter, they are contiguous arrays whose first dimension is the time step
+        Xsmooth = np.array(X)
+        Ssmooth = np.array(sqrtP)
+        Yfull_smooth = np.array(y_full)
         
         # iterating starting from the end and back
         # i : nTimeStep-2 -> 0
@@ -1171,47 +1737,47 @@ class UkfFmu:
             # define the sigma points
             Xs_i      = self.compute_sigma_points(x, pars, S_i)
 
-            logger.debug("Sigma point is Xs = {0}".format(Xs_i))
+            logger.debug("Sigma point is Xs = %s", Xs_i)
             
             # mean of the sigma points
             Xs_i_ave    = x_i
 
-            logger.debug("Mean value of the sigma point is Xs_i_ave = {0}".format(Xs_i_ave))
-            logger.debug("Simulate from {0} to {1}".format(time[i], time[i+1]))
+            logger.debug("Mean value of the sigma point is Xs_i_ave = %s", Xs_i_ave)
+            logger.debug("Simulate from %s to %s", time[i], time[i+1])
                 
             # compute the projected (state) points (each sigma points is propagated through the state transition function)
             X_plus_1, Z_plus_1, Xfull_plus_1, Zfull_plus_1 = self.sigma_point_proj(Xs_i, time[i], time[i+1])
 
-            logger.debug("Propagated sigma points X_plus_1 = {0}".format(X_plus_1))
+            logger.debug("Propagated sigma points X_plus_1 = %s", X_plus_1)
             
             # average of the sigma points
             x_ave_plus_1 = self.average_proj(X_plus_1)
 
-            logger.debug("Averaged propagated sigma points x_ave_plus_1 = {0}".format(x_ave_plus_1))
+            logger.debug("Averaged propagated sigma points x_ave_plus_1 = %s", x_ave_plus_1)
             
             # compute the new covariance matrix
-            Snew = self.compute_S(X_plus_1, x_ave_plus_1, sqrtQ)
+            Snew = self._compute_sqrt_cov(X_plus_1, x_ave_plus_1, sqrtQ)
 
-            logger.debug("Former S matrix is = {0}".format(S_i))
-            logger.debug("New matrix is Snew = {0}".format(Snew))
+            logger.debug("Former S matrix is = %s", S_i)
+            logger.debug("New matrix is Snew = %s", Snew)
             
             # compute the cross covariance matrix of the two states
             # (new state already corrected, coming from the "future", and the new just computed through the projection)
             Cxx  = self.compute_cov_x_x(X_plus_1, x_ave_plus_1, Xs_i, Xs_i_ave)
 
-            logger.debug("Cross state-state covariance Cxx = {0}".format(Cxx))
+            logger.debug("Cross state-state covariance Cxx = %s", Cxx)
             
             # gain for the back propagation
-            firstDivision = np.linalg.lstsq(Snew.T, Cxx.T)[0]
-            D             = np.linalg.lstsq(Snew, firstDivision)[0]
+            D = self.sqrt_solve(Snew, Cxx.T)
             
-            correction = np.dot(np.matrix(Xsmooth[i+1]) - x_ave_plus_1, D)
-            logger.debug("Old state is X = {0}".format(X[i]))
-            logger.debug("Error is err = {0}".format(Xsmooth[i+1] - x_ave_plus_1))
-            logger.debug("Correction = {0}".format(correction))
+            correction = (np.atleast_2d(Xsmooth[i+1]) - x_ave_plus_1) @ D
+            logger.debug("Old state is X = %s", X[i])
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Error is err = %s", Xsmooth[i+1] - x_ave_plus_1)
+            logger.debug("Correction = %s", correction)
             
             # correction (i.e. smoothing, of the state estimation and covariance matrix)
-            Xsmooth[i]  = X[i] + np.squeeze(np.array(correction[0,:]))
+            Xsmooth[i]  = X[i] + correction.ravel()
             
             # How to introduce constrained estimation
             Xsmooth[i]  = self.constrained_state(Xsmooth[i])
@@ -1222,8 +1788,9 @@ class UkfFmu:
             V          = np.dot(D.T, Ssmooth[i+1] - Snew)
             Ssmooth[i] = self.chol_update(sqrtP[i], V, -1*np.ones(self.n_state_obs + self.n_pars))
 
-            logger.debug("New smoothed state Xsmooth = {0}".format(Xsmooth[i]))
-            logger.debug("Ssmooth difference is = {0}".format(sqrtP[i] - Ssmooth[i]))
+            logger.debug("New smoothed state Xsmooth = %s", Xsmooth[i])
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Ssmooth difference is = %s", sqrtP[i] - Ssmooth[i])
         
         # correct the shape of the last element that has not been smoothed
         # Yfull_smooth[-1] = Yfull_smooth[-1][0]    # Krzysztof: This line is likely a bug. This code
@@ -1254,22 +1821,46 @@ class UkfFmu:
         :return: a tuple that contains the selected start and stop elements from ``time``
           that are the closest to ``start`` and ``stop``.
         :rtype: tuple
+        
+        :raises TypeError: if ``start`` or ``stop`` are not datetime objects, or if they are
+          timezone naive while ``time`` is timezone aware (and vice versa).
                 
         """
-        import bisect
+        import datetime
+        import pandas as pd
+        from estimationpy.fmu_utils.in_out_var import _datetime_index_to_ns
+        
+        time = pd.DatetimeIndex(time)
+        
+        # Numbers and datetime objects that are not comparable with the index
+        # are not converted, e.g., a naive datetime is not assumed to be UTC
+        for name, t in [("start", start), ("stop", stop)]:
+            if not isinstance(t, datetime.datetime):
+                msg = "The {0} time must be a datetime object, not {1}".format(name, type(t).__name__)
+                logger.error(msg)
+                raise TypeError(msg)
+            if (t.tzinfo is None) != (time.tz is None):
+                msg = "The {0} time {1} and the time index must be both timezone aware or naive".format(name, t)
+                logger.error(msg)
+                raise TypeError(msg)
                 
+        # The time stamps are compared as int64 nanoseconds
+        times_ns = _datetime_index_to_ns(time)
+        start_ns = pd.Timestamp(start).value
+        stop_ns = pd.Timestamp(stop).value
+        
         # Check that start and stop times are within the acceptable time range
-        if not (start >= time[0] and start <= time[-1]):
+        if not (times_ns[0] <= start_ns <= times_ns[-1]):
             raise IndexError("The start time has to be between the time range")
                 
-        if not (stop >= time[0] and stop <= time[-1]):
+        if not (times_ns[0] <= stop_ns <= times_ns[-1]):
             raise IndexError("The stop time has to be between the time range")
         
-        if not (stop >= start):
+        if not (stop_ns >= start_ns):
             raise ValueError("The stop time has to be after the start time")
         
-        # Find the closest value 
-        ix_start = bisect.bisect_left(time, start)
-        ix_stop = bisect.bisect_right(time, stop)
+        # Find the closest value with a binary search on the time stamps
+        ix_start = int(np.searchsorted(times_ns, start_ns, side = 'left'))
+        ix_stop = int(np.searchsorted(times_ns, stop_ns, side = 'right'))
         
         return (ix_start, ix_stop)
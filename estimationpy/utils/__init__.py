@@ -0,0 +1,6 @@
+"""
+This module contains general purpose utilities, e.g., for
+preparing the results of simulations and estimations to be
+plotted, that do not depend on FMU models.
+
+"""
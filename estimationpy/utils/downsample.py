@@ -0,0 +1,106 @@
+"""
+This module contains functions that reduce the number of points of a time
+series before plotting it. Plotting long time series point by point is slow,
+and the vertices beyond the resolution of the figure are not visible anyway.
+
+The module implements the Largest-Triangle-Three-Buckets (LTTB) algorithm,
+that retains the visual shape of the series better than a simple stride
+sampling, since it keeps peaks and valleys.
+
+"""
+import numpy
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def lttb_indices(x, y, n_out):
+    """
+    This function selects the indexes of the ``n_out`` points of the series
+    :math:`(x, y)` chosen by the Largest-Triangle-Three-Buckets algorithm.
+    The first and the last points are always selected. The remaining points are
+    divided into ``n_out - 2`` buckets, and from each bucket the algorithm selects
+    the point that forms the triangle with the largest area together with the
+    point selected in the previous bucket and the average of the next one.
+
+    :param numpy.ndarray x: the values of the x axis, sorted in ascending order.
+    :param numpy.ndarray y: the values of the y axis.
+    :param int n_out: the number of points to select, it must be at least 3.
+
+    :return: the indexes of the points selected, sorted in ascending order. If ``n_out``
+      is greater or equal than the number of points all the indexes are returned.
+    :rtype: numpy.ndarray
+
+    :raises ValueError: if ``x`` and ``y`` have different lengths or ``n_out`` is
+      lower than 3.
+    """
+    x = numpy.asarray(x, dtype=numpy.float64)
+    y = numpy.asarray(y, dtype=numpy.float64)
+    N = x.size
+
+    if y.size != N:
+        msg = "The arrays x and y must have the same length, {0} != {1}".format(N, y.size)
+        logger.error(msg)
+        raise ValueError(msg)
+
+    if n_out < 3:
+        msg = "The number of points selected by LTTB must be at least 3, {0} requested".format(n_out)
+        logger.error(msg)
+        raise ValueError(msg)
+
+    if n_out >= N:
+        return numpy.arange(N)
+
+    # Edges of the buckets, they cover all the points but the first and the last one
+    edges = numpy.linspace(1, N - 1, n_out - 1).astype(numpy.intp)
+    sizes = numpy.diff(edges)
+
+    # Average of each bucket, used as third vertex of the triangles of the previous bucket
+    avg_x = numpy.add.reduceat(x[:N - 1], edges[:-1]) / sizes
+    avg_y = numpy.add.reduceat(y[:N - 1], edges[:-1]) / sizes
+
+    idx = numpy.empty(n_out, dtype=numpy.intp)
+    idx[0] = 0
+    idx[-1] = N - 1
+
+    a = 0
+    n_buckets = n_out - 2
+    for i in range(n_buckets):
+        lo = edges[i]
+        hi = edges[i + 1]
+
+        # The last bucket uses the last point instead of the average of the next bucket
+        if i < n_buckets - 1:
+            cx = avg_x[i + 1]
+            cy = avg_y[i + 1]
+        else:
+            cx = x[-1]
+            cy = y[-1]
+
+        # Twice the area of the triangles, the factor does not change the selection
+        area = numpy.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + int(numpy.argmax(area))
+        idx[i + 1] = a
+
+    return idx
+
+
+def lttb(x, y, n_out):
+    """
+    This function downsamples the series :math:`(x, y)` to ``n_out`` points
+    using the Largest-Triangle-Three-Buckets algorithm, see :func:`lttb_indices`.
+    The first and the last points of the series are preserved.
+
+    :param numpy.ndarray x: the values of the x axis, sorted in ascending order.
+    :param numpy.ndarray y: the values of the y axis.
+    :param int n_out: the number of points of the downsampled series, it must be at least 3.
+
+    :return: a tuple with the values of the x and y axis of the downsampled series.
+    :rtype: tuple(numpy.ndarray, numpy.ndarray)
+
+    :raises ValueError: if ``x`` and ``y`` have different lengths or ``n_out`` is
+      lower than 3.
+    """
+    idx = lttb_indices(x, y, n_out)
+    return numpy.asarray(x)[idx], numpy.asarray(y)[idx]
@@ -0,0 +1,30 @@
+"""
+This module provides the decorators used to compile the numeric kernels
+of **EstimationPy** with **numba**.
+
+**numba** is an optional dependency. When it is not installed the module provides
+replacements for ``njit`` and ``prange`` so that the kernels run as regular
+Python functions, and the flag ``HAS_NUMBA`` is False. Modules that have a
+faster alternative to a pure Python kernel, e.g., a BLAS routine, can check
+this flag to choose the implementation.
+"""
+
+try:
+    from numba import njit, prange
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+    def njit(*args, **kwargs):
+        """
+        Replacement for ``numba.njit`` used when numba is not installed,
+        it returns the decorated function unchanged.
+        """
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+
+        def decorator(func):
+            return func
+        return decorator
+
+    prange = range